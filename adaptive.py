@@ -0,0 +1,69 @@
+import threading
+
+# 质量等级：(识别区域缩放比例, 每处理一帧之前跳过的帧数)，等级越高越省CPU
+LEVELS = ((1.0, 0), (0.75, 0), (0.5, 0), (0.5, 1), (0.35, 1), (0.35, 2))
+
+
+class AdaptiveController:
+    # 根据处理耗时的滑动平均调整缩放比例和跳帧数：超出帧预算时降低质量，有余量时逐级恢复
+    def __init__(self, frame_budget=None, levels=LEVELS, smoothing=0.2, high_water=0.9, low_water=0.4,
+                 hold_frames=15):
+        self.frame_budget = frame_budget  # 每帧可用的处理时间（秒），为None时由帧率决定
+        self.levels = levels
+        self.smoothing = smoothing
+        self.high_water = high_water
+        self.low_water = low_water
+        self.hold_frames = hold_frames  # 调整等级后至少保持的帧数，避免来回抖动
+        self.lock = threading.Lock()
+        self.level = 0
+        self.average = None
+        self.hold = 0
+        self.skip_counter = 0
+        self.skipped = 0
+        self.level_changes = 0
+
+    def set_frame_rate(self, fps):
+        if self.frame_budget is None and fps > 0:
+            self.frame_budget = 1.0 / fps
+
+    def scale(self):
+        return self.levels[self.level][0]
+
+    def should_skip(self):
+        # 每个被处理的帧之前跳过skip帧；被跳过的帧不进入识别窗口，窗口仍然按处理过的帧投票
+        with self.lock:
+            skip = self.levels[self.level][1]
+            if self.skip_counter < skip:
+                self.skip_counter += 1
+                self.skipped += 1
+                return True
+            self.skip_counter = 0
+            return False
+
+    def update(self, elapsed):
+        with self.lock:
+            if self.average is None:
+                self.average = elapsed
+            else:
+                self.average += self.smoothing * (elapsed - self.average)
+            if self.frame_budget is None:
+                return
+            if self.hold > 0:
+                self.hold -= 1
+                return
+            # 跳帧时每个被处理的帧可以使用多个帧的时间
+            budget = self.frame_budget * (self.levels[self.level][1] + 1)
+            if self.average > budget * self.high_water and self.level < len(self.levels) - 1:
+                self.level += 1
+            elif self.average < budget * self.low_water and self.level > 0:
+                self.level -= 1
+            else:
+                return
+            self.hold = self.hold_frames
+            self.level_changes += 1
+
+    def stats(self):
+        with self.lock:
+            scale, skip = self.levels[self.level]
+            return {'level': self.level, 'scale': scale, 'skip': skip, 'skipped': self.skipped,
+                    'average_ms': (self.average or 0.0) * 1000.0, 'level_changes': self.level_changes}
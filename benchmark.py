@@ -0,0 +1,89 @@
+import argparse
+import json
+import time
+
+from frame_source import open_source
+from hand_rec import HandDetection
+from metrics import Metrics, PERCENTILES
+from motion_gate import MotionGate
+
+STAGES = ('capture', 'motion_gate', 'bilateral', 'skin_detection', 'contour_detection', 'gesture_detection', 'window_rec', 'total')
+
+
+def run_benchmark(source, detector=None, max_frames=None, warmup=5):
+    # 不依赖摄像头和界面，逐帧执行与run()相同的处理流程，各阶段的耗时由Metrics记录
+    if detector is None:
+        detector = HandDetection(None)
+    metrics = detector.metrics = Metrics(enabled=False, window=None)
+    frames = 0
+    gated = 0
+    clock = time.perf_counter
+    start_time = None
+    # 被运动检测跳过的帧也计入max_frames，静止的画面不会一直运行下去
+    while source.isOpened() and (max_frames is None or frames + gated < max_frames + warmup):
+        with metrics.stage('capture'):
+            ret, frame = source.read()
+        if not ret or frame is None:
+            continue
+        if not detector.gate_frame(frame):
+            gated += 1
+            time.sleep(detector.motion_gate.frame_interval())
+            continue
+        if frames == warmup:
+            # 预热结束后才开始统计
+            metrics.enabled = True
+            start_time = clock()
+        frames += 1
+
+        with metrics.stage('total'):
+            res, img_rgb, frame_to_show = detector.process_adaptive(frame)
+            detector.handle_result(res, img_rgb, frame_to_show)
+        metrics.tick()
+    source.release()
+
+    report = metrics.snapshot()
+    elapsed = clock() - start_time if start_time is not None else 0.0
+    report['frames'] = max(0, frames - warmup)
+    report['gated_frames'] = gated
+    report['seconds'] = elapsed
+    report['fps'] = report['frames'] / elapsed if elapsed > 0 else 0.0
+    return report
+
+
+def print_report(report):
+    print('frames: %d  gated: %d  time: %.2fs  fps: %.1f'
+          % (report['frames'], report['gated_frames'], report['seconds'], report['fps']))
+    header = '%-18s %7s %9s' % ('stage', 'count', 'mean(ms)') + ''.join(' %8s' % ('p%d' % p) for p in PERCENTILES)
+    print(header)
+    names = [name for name in STAGES if name in report['stages']]
+    names += sorted(name for name in report['stages'] if name not in STAGES)
+    for name in names:
+        item = report['stages'][name]
+        line = '%-18s %7d %9.3f' % (name, item['count'], item['mean_ms'])
+        line += ''.join(' %8.3f' % item['p%d_ms' % p] for p in PERCENTILES)
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='HandDetection 离线性能测试')
+    parser.add_argument('source', nargs='?', default='synthetic',
+                        help='视频文件、图片文件夹、摄像头编号或 synthetic[:N]')
+    parser.add_argument('--frames', type=int, default=None, help='最多读取的帧数（包括被运动检测跳过的帧）')
+    parser.add_argument('--json', default=None, help='把结果写入json文件')
+    parser.add_argument('--full-frame-otsu', action='store_true', help='在整帧上计算OTSU阈值')
+    parser.add_argument('--skin-engine', choices=('otsu', 'lut'), default='otsu', help='肤色分割方式')
+    parser.add_argument('--track', action='store_true', help='只在上一帧手部附近的窗口中分割')
+    parser.add_argument('--motion-gate', action='store_true', help='识别区域静止时跳过识别')
+    args = parser.parse_args()
+
+    hand_detection = HandDetection(None)
+    hand_detection.full_frame_otsu = args.full_frame_otsu
+    hand_detection.skin_engine = args.skin_engine
+    hand_detection.track_hand = args.track
+    if args.motion_gate:
+        hand_detection.motion_gate = MotionGate()
+    result = run_benchmark(open_source(args.source), hand_detection, max_frames=args.frames)
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
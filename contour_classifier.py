@@ -0,0 +1,104 @@
+import math
+
+import cv2
+import numpy as np
+
+ANGLE_BINS = 16
+
+
+def contour_features(contour):
+    # 与旋转有关的特征，长度固定：
+    # 以质心为中心按角度分成ANGLE_BINS个扇区，每个扇区中轮廓点的最远距离（除以手的尺度）
+    # 每个扇区中深度足够的凸缺陷个数（手指之间的缝隙所在的方向），以及凸性和缺陷总数
+    points = contour.reshape(-1, 2).astype(np.float64)
+    moments = cv2.moments(contour)
+    area = moments['m00']
+    features = np.zeros(2 * ANGLE_BINS + 3)
+    if area <= 0:
+        return features
+    center = np.array([moments['m10'] / area, moments['m01'] / area])
+    scale = math.sqrt(area)
+    offset = points - center
+    bins = ((np.arctan2(offset[:, 1], offset[:, 0]) + math.pi) * (ANGLE_BINS / (2 * math.pi))).astype(np.intp)
+    bins %= ANGLE_BINS
+    radius = np.sqrt((offset ** 2).sum(axis=1)) / scale
+    reach = np.zeros(ANGLE_BINS)
+    np.maximum.at(reach, bins, radius)
+    features[:ANGLE_BINS] = reach
+
+    hull = cv2.convexHull(contour, returnPoints=False)
+    hull_area = cv2.contourArea(cv2.convexHull(contour))
+    features[-3] = area / hull_area if hull_area > 0 else 1.0
+    if len(hull) > 3:
+        try:
+            defects = cv2.convexityDefects(contour, hull)
+        except cv2.error:
+            defects = None
+        if defects is not None:
+            depth = defects[:, 0, 3] / 256.0 / scale
+            deep = depth > 0.15
+            far = points[defects[deep, 0, 2]] - center
+            gap_bins = ((np.arctan2(far[:, 1], far[:, 0]) + math.pi) *
+                        (ANGLE_BINS / (2 * math.pi))).astype(np.intp) % ANGLE_BINS
+            features[ANGLE_BINS:2 * ANGLE_BINS] = np.bincount(gap_bins, minlength=ANGLE_BINS)
+            features[-2] = np.count_nonzero(deep)
+            features[-1] = depth[deep].sum()
+    return features
+
+
+class CentroidClassifier:
+    # 最近质心分类器：特征标准化后，每个(fingers, direction)类别一个质心
+    # 与所有质心的距离都超过reject_distance时认为不是手势，返回detected为False的结果
+    def __init__(self, mean, std, centroids, fingers, directions, reject_distance):
+        self.mean = mean
+        self.std = std
+        self.centroids = centroids
+        self.fingers = fingers
+        self.directions = directions
+        self.reject_distance = reject_distance
+        self.centroid_norms = (centroids ** 2).sum(axis=1)
+
+    @classmethod
+    def train(cls, features, fingers, directions, reject_quantile=0.99):
+        features = np.asarray(features, np.float64)
+        mean = features.mean(axis=0)
+        std = features.std(axis=0)
+        std[std < 1e-6] = 1.0
+        normalized = (features - mean) / std
+        labels = sorted(set(zip(fingers, directions)))
+        index = {label: i for i, label in enumerate(labels)}
+        target = np.array([index[label] for label in zip(fingers, directions)])
+        centroids = np.stack([normalized[target == i].mean(axis=0) for i in range(len(labels))])
+        distances = np.sqrt(((normalized - centroids[target]) ** 2).sum(axis=1))
+        reject_distance = float(np.quantile(distances, reject_quantile)) * 1.5
+        return cls(mean, std, centroids, np.array([f for f, _ in labels], np.int8),
+                   np.array([d for _, d in labels]), reject_distance)
+
+    def predict(self, features):
+        # 对一批特征一次计算到所有质心的距离，返回(类别序号, 距离)
+        normalized = (np.atleast_2d(features) - self.mean) / self.std
+        squared = (normalized ** 2).sum(axis=1)[:, None] - 2 * normalized @ self.centroids.T + self.centroid_norms
+        best = np.argmin(squared, axis=1)
+        return best, np.sqrt(np.maximum(squared[np.arange(len(best)), best], 0))
+
+    def classify_batch(self, contours):
+        if not contours:
+            return []
+        best, distance = self.predict(np.stack([contour_features(c) for c in contours]))
+        return [{"detected": bool(d <= self.reject_distance), "fingers": int(self.fingers[b]),
+                 "direction": str(self.directions[b])} for b, d in zip(best, distance)]
+
+    def classify(self, contour, drawing=None):
+        return self.classify_batch([contour])[0]
+
+    def save(self, path):
+        np.savez_compressed(path, mean=self.mean.astype(np.float32), std=self.std.astype(np.float32),
+                            centroids=self.centroids.astype(np.float32), fingers=self.fingers,
+                            directions=self.directions, reject_distance=np.float32(self.reject_distance))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data['mean'].astype(np.float64), data['std'].astype(np.float64),
+                   data['centroids'].astype(np.float64), data['fingers'], data['directions'],
+                   float(data['reject_distance']))
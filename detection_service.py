@@ -0,0 +1,152 @@
+import argparse
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from frame_source import FramePacer, open_source
+from gesture_bus import GestureBus
+from hand_rec import HandDetection
+
+
+class DetectionSession:
+    # 一路帧来源：有自己的HandDetection（识别窗口、防抖计数、跟踪状态）和手势总线
+    # 同一路同时最多只有一帧在处理，处理期间到达的帧只保留最新的一帧，因此结果总是按帧顺序进入识别窗口
+    def __init__(self, service, name, source, detector=None):
+        self.service = service
+        self.name = name
+        self.source = source
+        self.detector = detector if detector is not None else HandDetection(None, source=source, bus=GestureBus())
+        self.detector.source_name = name
+        self.bus = self.detector.bus
+        self.on_frame = None  # 可选的预览回调，参数为调试图
+        self.lock = threading.Lock()
+        self.busy = False
+        self.pending = None
+        self.thread = None
+        self.frames_read = 0
+        self.frames_processed = 0
+        self.dropped = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.capture_loop, name='capture-%s' % self.name, daemon=True)
+        self.thread.start()
+
+    def capture_loop(self):
+        pacer = FramePacer.for_source(self.source)
+        while not self.service.stop_event.is_set() and self.source.isOpened():
+            pacer.wait()
+            ret, frame = self.source.read()
+            if not ret or frame is None:
+                continue
+            self.frames_read += 1
+            item = (frame, time.perf_counter())
+            if not self.detector.gate_frame(frame, item[1]):
+                # 这一路没有人，不占用线程池
+                time.sleep(self.detector.motion_gate.frame_interval())
+                continue
+            with self.lock:
+                if self.busy:
+                    if self.pending is not None:
+                        self.dropped += 1
+                    self.pending = item
+                    continue
+                self.busy = True
+            self.service.submit(self, item)
+        self.source.release()
+
+    def process(self, item):
+        # 在线程池中执行，OpenCV的函数会释放GIL，多路摄像头可以同时使用多个核
+        frame, captured_at = item
+        detector = self.detector
+        try:
+            res, img_rgb, frame_to_show = detector.process_adaptive(frame)
+            detector.handle_result(res, img_rgb, frame_to_show, captured_at)
+            if self.on_frame is not None:
+                self.on_frame(img_rgb)
+        except Exception:
+            # 线程池不会报告异常，这里打印出来；这一帧出错时继续处理后面的帧
+            traceback.print_exc()
+        finally:
+            with self.lock:
+                self.frames_processed += 1
+                item, self.pending = self.pending, None
+                if item is None:
+                    self.busy = False
+        if item is not None:
+            self.service.submit(self, item)
+
+    def stats(self):
+        with self.lock:
+            return {'frames_read': self.frames_read, 'frames_processed': self.frames_processed,
+                    'dropped': self.dropped, 'busy': self.busy}
+
+
+class DetectionService:
+    # 管理多路帧来源，所有来源的帧都在同一个线程池中处理
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='detection')
+        self.stop_event = threading.Event()
+        self.sessions = {}
+        self.started = False
+
+    def add_source(self, name, source, detector=None):
+        # 服务已经启动时，新加入的来源立即开始采集
+        session = DetectionSession(self, name, source, detector)
+        self.sessions[name] = session
+        if self.started:
+            session.start()
+        return session
+
+    def submit(self, session, item):
+        if self.stop_event.is_set():
+            return
+        try:
+            self.executor.submit(session.process, item)
+        except RuntimeError:
+            # 线程池已经关闭
+            pass
+
+    def start(self):
+        self.started = True
+        for session in self.sessions.values():
+            if session.thread is None:
+                session.start()
+        return self
+
+    def stop(self, wait=True):
+        self.stop_event.set()
+        for session in self.sessions.values():
+            if session.thread is not None:
+                session.thread.join()
+        self.executor.shutdown(wait=wait)
+
+    def join(self):
+        for session in self.sessions.values():
+            if session.thread is not None:
+                session.thread.join()
+
+    def stats(self):
+        return {name: session.stats() for name, session in self.sessions.items()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='多路手势识别服务')
+    parser.add_argument('sources', nargs='+', help='摄像头编号、视频文件、图片文件夹或 synthetic[:N]')
+    parser.add_argument('--workers', type=int, default=None, help='线程池大小，默认为CPU核数')
+    args = parser.parse_args()
+
+    service = DetectionService(args.workers)
+    for i, spec in enumerate(args.sources):
+        source_name = '%d:%s' % (i, spec)
+        service.add_source(source_name, open_source(spec)).bus.subscribe(
+            lambda event: print(event.source, event))
+    service.start()
+    try:
+        service.join()
+    except KeyboardInterrupt:
+        pass
+    service.stop()
+    print(service.stats())
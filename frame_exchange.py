@@ -0,0 +1,52 @@
+import threading
+
+import cv2
+import numpy as np
+
+
+class FrameExchange:
+    # 三缓冲帧交换：检测线程写后台缓冲区，界面线程读前台缓冲区，中间缓冲区保存最新的一帧
+    # 缓冲区预先分配并在帧之间复用，尺寸变化时才重新分配
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buffers = [None, None, None]
+        self.back = 0
+        self.middle = 1
+        self.front = 2
+        self.fresh = False
+        self.written = 0
+        self.skipped = 0  # 界面线程来不及显示、被新帧覆盖的帧数
+
+    def ensure_buffer(self, index, shape):
+        buf = self.buffers[index]
+        if buf is None or buf.shape != shape:
+            buf = np.empty(shape, np.uint8)
+            self.buffers[index] = buf
+        return buf
+
+    def write(self, frame):
+        # 在写入线程中调用：灰度图直接拷贝，彩色图只做一次BGR到RGB的转换
+        # 返回True表示上一帧已被取走，需要通知界面线程；否则界面线程还有未处理的通知
+        if frame.ndim == 2:
+            buf = self.ensure_buffer(self.back, frame.shape)
+            np.copyto(buf, frame)
+        else:
+            buf = self.ensure_buffer(self.back, frame.shape[:2] + (3,))
+            cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=buf)
+        with self.lock:
+            self.back, self.middle = self.middle, self.back
+            notify = not self.fresh
+            if self.fresh:
+                self.skipped += 1
+            self.fresh = True
+            self.written += 1
+        return notify
+
+    def acquire(self):
+        # 在界面线程中调用：取出最新的一帧，在下一次acquire之前不会被写入线程覆盖
+        with self.lock:
+            if not self.fresh:
+                return None
+            self.front, self.middle = self.middle, self.front
+            self.fresh = False
+            return self.buffers[self.front]
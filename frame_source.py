@@ -0,0 +1,212 @@
+import math
+import os
+import time
+
+import cv2
+import numpy as np
+
+IMAGE_SUFFIXES = ('.png', '.jpg', '.jpeg', '.bmp')
+
+# 合成图像使用的颜色（BGR），肤色的Cr分量明显高于背景，便于OTSU分割
+SKIN_COLOR = (100, 140, 210)
+BACKGROUND_COLOR = (120, 110, 100)
+
+
+class FramePacer:
+    # 按帧来源的帧率读取：视频文件、图片和合成帧按原帧间隔读取，不一次读完；摄像头的read本身会等到下一帧，不需要等待
+    # 落后超过一帧时（例如处理或休眠耗时较长）从当前时间重新计时，不连续读取来追赶
+    def __init__(self, fps, live=False):
+        self.interval = 1.0 / fps if fps > 0 and not live else 0.0
+        self.next_time = None
+
+    @classmethod
+    def for_source(cls, source):
+        return cls(source.fps(), getattr(source, 'live', False))
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.perf_counter()
+        if self.next_time is None or now - self.next_time > self.interval:
+            self.next_time = now
+        elif self.next_time > now:
+            time.sleep(self.next_time - now)
+        self.next_time += self.interval
+
+
+class CameraSource:
+    # 对cv2.VideoCapture的简单包装，保持与文件源相同的接口
+    live = True
+
+    def __init__(self, index=0, brightness=10):
+        self.camera = cv2.VideoCapture(index)
+        self.camera.set(cv2.CAP_PROP_BRIGHTNESS, brightness)
+
+    def isOpened(self):
+        return self.camera.isOpened()
+
+    def read(self):
+        return self.camera.read()
+
+    def fps(self):
+        return self.camera.get(cv2.CAP_PROP_FPS) or 30.0
+
+    def drain(self, limit=8):
+        # 丢掉驱动中积压的旧帧：积压的帧grab立即返回，需要等待新帧时说明已经取完
+        wait = 0.5 / self.fps()
+        for _ in range(limit):
+            start = time.perf_counter()
+            if not self.camera.grab() or time.perf_counter() - start > wait:
+                break
+
+    def release(self):
+        self.camera.release()
+
+
+def drain_source(source):
+    # 运动检测休眠时采集变慢，摄像头驱动中会积压旧帧，唤醒时先丢掉；文件和合成帧没有积压，不需要处理
+    drain = getattr(source, 'drain', None)
+    if drain is not None:
+        drain()
+
+
+class VideoFileSource:
+    # 从视频文件中逐帧读取，读完后isOpened返回False
+    def __init__(self, path, loop=False):
+        self.path = path
+        self.loop = loop
+        self.capture = cv2.VideoCapture(path)
+        self.finished = False
+
+    def isOpened(self):
+        return not self.finished and self.capture.isOpened()
+
+    def read(self):
+        ret, frame = self.capture.read()
+        if not ret and self.loop:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.capture.read()
+        if not ret:
+            self.finished = True
+            return False, None
+        return True, frame
+
+    def fps(self):
+        return self.capture.get(cv2.CAP_PROP_FPS) or 30.0
+
+    def release(self):
+        self.finished = True
+        self.capture.release()
+
+
+class ImageDirSource:
+    # 按文件名顺序读取文件夹中的图片
+    def __init__(self, folder, loop=False, frame_rate=30.0):
+        self.files = sorted(os.path.join(folder, name) for name in os.listdir(folder)
+                            if name.lower().endswith(IMAGE_SUFFIXES))
+        self.loop = loop
+        self.frame_rate = frame_rate
+        self.position = 0
+
+    def isOpened(self):
+        return len(self.files) > 0 and (self.loop or self.position < len(self.files))
+
+    def read(self):
+        if not self.isOpened():
+            return False, None
+        frame = cv2.imread(self.files[self.position % len(self.files)])
+        self.position += 1
+        return frame is not None, frame
+
+    def fps(self):
+        return self.frame_rate
+
+    def release(self):
+        self.position = len(self.files)
+        self.loop = False
+
+
+def render_hand(width=640, height=480, fingers=5, angle=-90.0, thumb=False, center=None, scale=1.0,
+                noise=8, seed=None):
+    # 绘制一只简化的手：手掌为圆形，手指为粗线段，angle为手指朝向（度，图像坐标系）
+    rng = np.random.RandomState(seed)
+    frame = np.empty((height, width, 3), np.uint8)
+    frame[:] = BACKGROUND_COLOR
+    # 手部区域位于未翻转图像的左上部分，翻转后即为HandDetection的识别区域
+    if center is None:
+        center = (int(width * 0.17), int(height * 0.38))
+    radius = int(min(width, height) * 0.09 * scale)
+    finger_len = int(radius * 2.0)
+    finger_width = max(2, int(radius * 0.42))
+    cv2.circle(frame, center, radius, SKIN_COLOR, -1)
+
+    # 手腕，朝向与手指相反
+    wrist_angle = math.radians(angle + 180)
+    wrist_end = (int(center[0] + math.cos(wrist_angle) * radius * 4),
+                 int(center[1] + math.sin(wrist_angle) * radius * 4))
+    cv2.line(frame, center, wrist_end, SKIN_COLOR, int(radius * 1.4))
+
+    spread = 24.0
+    for i in range(fingers):
+        finger_angle = math.radians(angle + spread * (i - (fingers - 1) / 2.0))
+        tip = (int(center[0] + math.cos(finger_angle) * (radius + finger_len)),
+               int(center[1] + math.sin(finger_angle) * (radius + finger_len)))
+        cv2.line(frame, center, tip, SKIN_COLOR, finger_width)
+    if thumb:
+        # 大拇指与四指大致垂直
+        thumb_angle = math.radians(angle - 90)
+        tip = (int(center[0] + math.cos(thumb_angle) * (radius + finger_len * 0.8)),
+               int(center[1] + math.sin(thumb_angle) * (radius + finger_len * 0.8)))
+        cv2.line(frame, center, tip, SKIN_COLOR, finger_width)
+
+    if noise:
+        frame = cv2.add(frame, rng.randint(0, noise, frame.shape).astype(np.uint8))
+    return frame
+
+
+class SyntheticHandSource:
+    # 在内存中生成合成手势帧，poses为(fingers, angle, thumb)的列表，依次循环
+    def __init__(self, count=300, width=640, height=480, poses=None, variants=8, seed=0, frame_rate=30.0):
+        if poses is None:
+            poses = [(5, -90.0, False), (3, -90.0, False), (4, 0.0, True), (4, 180.0, True)]
+        self.count = count
+        self.frame_rate = frame_rate
+        self.position = 0
+        # 预先渲染，避免把绘制的时间计入基准测试
+        self.frames = []
+        rng = np.random.RandomState(seed)
+        for fingers, angle, thumb in poses:
+            for _ in range(variants):
+                jitter = rng.uniform(-6, 6)
+                self.frames.append(render_hand(width, height, fingers, angle + jitter, thumb,
+                                               seed=rng.randint(1 << 30)))
+
+    def isOpened(self):
+        return self.position < self.count
+
+    def read(self):
+        if not self.isOpened():
+            return False, None
+        frame = self.frames[self.position % len(self.frames)]
+        self.position += 1
+        return True, frame.copy()
+
+    def fps(self):
+        return self.frame_rate
+
+    def release(self):
+        self.position = self.count
+
+
+def open_source(spec):
+    # 根据字符串选择帧来源：数字为摄像头，文件夹为图片序列，synthetic[:N]为合成帧，其余视为视频文件
+    if spec is None:
+        return CameraSource(0)
+    if isinstance(spec, int) or str(spec).isdigit():
+        return CameraSource(int(spec))
+    if str(spec).startswith('synthetic'):
+        _, _, count = str(spec).partition(':')
+        return SyntheticHandSource(int(count) if count else 300)
+    if os.path.isdir(spec):
+        return ImageDirSource(spec)
+    return VideoFileSource(spec)
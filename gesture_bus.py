@@ -0,0 +1,87 @@
+import enum
+import threading
+import time
+
+
+class Gesture(enum.Enum):
+    PLAY_PAUSE = 'PLAY_PAUSE'
+    NEXT = 'NEXT'
+    PREV = 'PREV'
+    VOLUME_UP = 'VOLUME_UP'
+    VOLUME_DOWN = 'VOLUME_DOWN'
+    CHANGE_MODE = 'CHANGE_MODE'
+
+
+DIRECTION_GESTURES = {
+    'RIGHT': Gesture.NEXT,
+    'LEFT': Gesture.PREV,
+    'UP': Gesture.VOLUME_UP,
+    'DOWN': Gesture.VOLUME_DOWN,
+}
+
+
+def gesture_from_result(fingers, direction):
+    # 手指数优先于方向：三指播放/暂停，五指切换播放模式
+    if fingers == 3:
+        return Gesture.PLAY_PAUSE
+    if fingers == 5:
+        return Gesture.CHANGE_MODE
+    return DIRECTION_GESTURES.get(direction)
+
+
+class GestureEvent:
+    def __init__(self, gesture, fingers=None, direction=None, timestamp=None, source=None):
+        self.gesture = gesture
+        self.fingers = fingers
+        self.direction = direction
+        # 时间戳使用perf_counter，默认为事件创建的时间，也可以传入帧采集的时间
+        self.timestamp = time.perf_counter() if timestamp is None else timestamp
+        self.source = source
+        self.dispatched_at = None
+
+    def mark_dispatched(self):
+        self.dispatched_at = time.perf_counter()
+        return self.latency()
+
+    def latency(self):
+        # 从采集到执行的延迟，单位毫秒
+        if self.dispatched_at is None:
+            return None
+        return (self.dispatched_at - self.timestamp) * 1000.0
+
+    def to_dict(self):
+        return {'gesture': self.gesture.value, 'fingers': self.fingers, 'direction': self.direction,
+                'timestamp': self.timestamp, 'source': self.source}
+
+    @classmethod
+    def from_dict(cls, data):
+        # 与to_dict对应，用于从守护进程收到的事件；perf_counter在同一台机器的进程之间可以比较
+        return cls(Gesture(data['gesture']), data.get('fingers'), data.get('direction'), data.get('timestamp'),
+                   data.get('source'))
+
+    def __repr__(self):
+        return 'GestureEvent(%s, fingers=%s, direction=%s)' % (self.gesture.value, self.fingers, self.direction)
+
+
+class GestureBus:
+    # 线程安全的手势事件总线，发布时在发布者线程中依次调用订阅者
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.published = 0
+
+    def subscribe(self, callback):
+        with self.lock:
+            self.subscribers = self.subscribers + [callback]
+        return callback
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            self.subscribers = [s for s in self.subscribers if s != callback]
+
+    def publish(self, event):
+        with self.lock:
+            subscribers = self.subscribers
+            self.published += 1
+        for callback in subscribers:
+            callback(event)
@@ -0,0 +1,109 @@
+import argparse
+import time
+
+import numpy as np
+
+from contour_classifier import CentroidClassifier, contour_features
+from gesture_bus import gesture_from_result
+from gesture_eval import clip_from_spec
+from hand_rec import HandDetection
+from tuner import ContourRecorder
+
+# 每种手势对应的单帧结果(fingers, direction)，None为握拳等不应触发的姿势
+# 方向手势的手指数只需要不是3或5
+GESTURE_TARGETS = {
+    'PLAY_PAUSE': (3, 'NOT_FOUND'),
+    'CHANGE_MODE': (5, 'NOT_FOUND'),
+    'NEXT': (2, 'RIGHT'),
+    'PREV': (2, 'LEFT'),
+    'VOLUME_UP': (2, 'UP'),
+    'VOLUME_DOWN': (2, 'DOWN'),
+    None: (1, 'NOT_FOUND'),
+}
+
+
+class RuleClassifier:
+    # 原有的基于角度和斜率的规则，作为对照
+    def __init__(self, detector=None):
+        self.detector = detector if detector is not None else HandDetection(None)
+        self.scratch = np.zeros((1, 1, 3), np.uint8)
+
+    def classify(self, contour, drawing=None):
+        return self.detector.gesture_result(contour, self.scratch if drawing is None else drawing, None)
+
+    def classify_batch(self, contours):
+        return [self.classify(c) for c in contours]
+
+
+def collect_samples(specs, detector=None, margin=5):
+    # 从带标注的序列中取出每帧面积最大的轮廓和对应的手势名，跳过每段开头和结尾margin帧的过渡
+    recorder = ContourRecorder()
+    if detector is not None:
+        recorder.set_params(detector.get_params())
+    contours, labels = [], []
+    for spec in specs:
+        clip = clip_from_spec(spec)
+        for i, frame in enumerate(clip.read_frames()):
+            recorder.contour = None
+            recorder.process_frame(frame)
+            if recorder.contour is None:
+                continue
+            for start, end, label in clip.segments:
+                if start + margin <= i < end - margin:
+                    contours.append(recorder.contour)
+                    labels.append(label)
+                    break
+    return contours, labels
+
+
+def train_model(specs, margin=5):
+    contours, labels = collect_samples(specs, margin=margin)
+    features = np.stack([contour_features(c) for c in contours])
+    fingers = [GESTURE_TARGETS[label][0] for label in labels]
+    directions = [GESTURE_TARGETS[label][1] for label in labels]
+    return CentroidClassifier.train(features, fingers, directions), len(contours)
+
+
+def frame_accuracy(results, labels):
+    # 单帧结果对应的手势与标注相同即为正确，标注为None时结果不能对应任何手势
+    correct = 0
+    for res, label in zip(results, labels):
+        gesture = gesture_from_result(res['fingers'], res['direction']) if res['detected'] else None
+        correct += (gesture.name if gesture is not None else None) == label
+    return correct / len(labels) if labels else 0.0
+
+
+def benchmark(classifiers, specs, repeat=3):
+    contours, labels = collect_samples(specs)
+    report = {}
+    for name, classifier in classifiers.items():
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            results = classifier.classify_batch(contours)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        report[name] = {'samples': len(contours), 'accuracy': frame_accuracy(results, labels),
+                        'us_per_frame': best / max(1, len(contours)) * 1e6}
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='训练或评估基于特征的手势分类器')
+    parser.add_argument('command', choices=('train', 'bench'))
+    parser.add_argument('clips', nargs='*', default=None,
+                        help='带labels.csv的图片文件夹、带同名csv的视频或 synthetic[:N[:SEED]]')
+    parser.add_argument('--model', default='gesture_model.npz', help='模型文件')
+    args = parser.parse_args()
+
+    if args.command == 'train':
+        model, count = train_model(args.clips or ['synthetic:3:1'])
+        model.save(args.model)
+        print('trained on %d frames, %d classes, saved to %s' % (count, len(model.fingers), args.model))
+    else:
+        # 默认在与训练不同的合成序列上评估
+        result = benchmark({'rules': RuleClassifier(), 'centroid': CentroidClassifier.load(args.model)},
+                           args.clips or ['synthetic:2:7'])
+        for name, item in result.items():
+            print('%-10s samples %5d  accuracy %.3f  %.1fus/frame'
+                  % (name, item['samples'], item['accuracy'], item['us_per_frame']))
@@ -0,0 +1,216 @@
+import argparse
+import asyncio
+import base64
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+
+import cv2
+import numpy as np
+
+from frame_source import open_source
+from gesture_bus import GestureEvent
+from hand_rec import HandDetection
+from metrics import Metrics
+from motion_gate import MotionGate
+from pipeline import DetectionPipeline
+
+DEFAULT_SOCKET = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or '/tmp', 'gesture_dance.sock')
+
+
+class GestureDaemon:
+    # 不带界面的手势识别服务：识别在检测线程中执行，手势事件和可选的预览帧通过Unix socket推送给本机的客户端
+    # 协议为每行一个json：客户端连接后可以发送{"subscribe": ["gesture", "preview"]}，默认只订阅手势
+    # 服务端发送{"type": "gesture", ...}和{"type": "preview", "jpeg": base64}
+    # 对HandDetection来说守护进程就是播放器：订阅手势总线，并通过convert_image接收预览帧
+    def __init__(self, path=DEFAULT_SOCKET, preview_fps=5.0, jpeg_quality=70, max_buffer=1 << 20):
+        self.path = path
+        self.preview_interval = 1.0 / preview_fps if preview_fps > 0 else None
+        self.jpeg_quality = jpeg_quality
+        self.max_buffer = max_buffer  # 客户端来不及读取时，写缓冲超过该字节数就不再发送预览帧
+        self.loop = None
+        self.server = None
+        self.clients = {}  # writer -> 订阅的消息类型
+        self.preview_wanted = False
+        self.last_preview = 0.0
+        self.encoding = False
+        self.events_sent = 0
+        self.previews_sent = 0
+        self.previews_skipped = 0
+
+    # 以下两个函数在检测线程中调用
+    def post_gesture(self, event):
+        if self.loop is not None:
+            line = dict(event.to_dict(), type='gesture')
+            self.loop.call_soon_threadsafe(self.broadcast, 'gesture', line)
+
+    def convert_image(self, frame):
+        # 没有客户端订阅预览或未到发送时间时直接返回，编码在线程池中执行，不占用检测线程
+        if not self.preview_wanted or self.preview_interval is None or self.loop is None or self.encoding:
+            return
+        now = time.perf_counter()
+        if now - self.last_preview < self.preview_interval:
+            return
+        self.last_preview = now
+        self.encoding = True
+        self.loop.call_soon_threadsafe(self.schedule_preview, frame.copy())
+
+    def schedule_preview(self, frame):
+        future = self.loop.run_in_executor(None, self.encode_preview, frame)
+        future.add_done_callback(self.preview_done)
+
+    def encode_preview(self, frame):
+        ok, data = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ok:
+            return None
+        return {'type': 'preview', 'width': frame.shape[1], 'height': frame.shape[0],
+                'jpeg': base64.b64encode(data.tobytes()).decode('ascii')}
+
+    def preview_done(self, future):
+        self.encoding = False
+        line = future.result()
+        if line is not None:
+            self.broadcast('preview', line)
+
+    def broadcast(self, kind, message):
+        data = (json.dumps(message) + '\n').encode('utf-8')
+        for writer, topics in list(self.clients.items()):
+            if kind not in topics:
+                continue
+            if kind == 'preview' and writer.transport.get_write_buffer_size() > self.max_buffer:
+                self.previews_skipped += 1
+                continue
+            writer.write(data)
+            if kind == 'gesture':
+                self.events_sent += 1
+            else:
+                self.previews_sent += 1
+
+    def update_topics(self):
+        self.preview_wanted = any('preview' in topics for topics in self.clients.values())
+
+    async def handle_client(self, reader, writer):
+        self.clients[writer] = {'gesture'}
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    continue
+                if 'subscribe' in request:
+                    self.clients[writer] = set(request['subscribe'])
+                    self.update_topics()
+                if request.get('command') == 'stats':
+                    writer.write((json.dumps(dict(self.stats(), type='stats')) + '\n').encode('utf-8'))
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.pop(writer, None)
+            self.update_topics()
+            writer.close()
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        if os.path.exists(self.path):
+            # 只删除没有进程在监听的旧socket，不抢占正在运行的守护进程
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.connect(self.path)
+                except ConnectionRefusedError:
+                    os.unlink(self.path)
+                else:
+                    raise RuntimeError('another gesture daemon is listening on %s' % self.path)
+        self.server = await asyncio.start_unix_server(self.handle_client, path=self.path)
+        async with self.server:
+            await self.server.serve_forever()
+
+    def stats(self):
+        return {'clients': len(self.clients), 'events_sent': self.events_sent, 'previews_sent': self.previews_sent,
+                'previews_skipped': self.previews_skipped}
+
+
+class GestureClient(threading.Thread):
+    # 守护进程的客户端，在自己的线程中读取，断开后每隔retry秒重连
+    # on_event的参数为GestureEvent，on_preview的参数为BGR图像，回调在本线程中执行
+    def __init__(self, path=DEFAULT_SOCKET, on_event=None, on_preview=None, retry=1.0):
+        threading.Thread.__init__(self, name='gesture-client', daemon=True)
+        self.path = path
+        self.on_event = on_event
+        self.on_preview = on_preview
+        self.retry = retry
+        self.stop_event = threading.Event()
+        self.sock = None
+
+    def run(self):
+        topics = ['gesture'] + (['preview'] if self.on_preview is not None else [])
+        while not self.stop_event.is_set():
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                    self.sock = sock
+                    sock.connect(self.path)
+                    sock.sendall((json.dumps({'subscribe': topics}) + '\n').encode('utf-8'))
+                    for line in sock.makefile('rb'):
+                        try:
+                            self.handle_line(line)
+                        except Exception:
+                            # 无法解析的行（例如新版本的手势名）或回调中的异常只跳过这一行，不影响后面的消息
+                            traceback.print_exc()
+            except OSError:
+                pass
+            self.stop_event.wait(self.retry)
+
+    def handle_line(self, line):
+        message = json.loads(line)
+        kind = message.get('type')
+        if kind == 'gesture' and self.on_event is not None:
+            self.on_event(GestureEvent.from_dict(message))
+        elif kind == 'preview' and self.on_preview is not None:
+            data = np.frombuffer(base64.b64decode(message['jpeg']), np.uint8)
+            frame = cv2.imdecode(data, cv2.IMREAD_COLOR)
+            if frame is not None:
+                self.on_preview(frame)
+
+    def stop(self):
+        self.stop_event.set()
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='不带界面的手势识别服务，通过Unix socket推送手势事件')
+    parser.add_argument('source', nargs='?', default='0', help='摄像头编号、视频文件、图片文件夹或 synthetic[:N]')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='Unix socket路径')
+    parser.add_argument('--preview-fps', type=float, default=5.0, help='预览帧的最高帧率，为0时不提供预览')
+    parser.add_argument('--profile', default=None, help='调参工具生成的配置文件')
+    parser.add_argument('--motion-gate', action='store_true', help='识别区域静止时跳过识别')
+    parser.add_argument('--metrics-port', type=int, default=None, help='在本地端口提供Prometheus格式的统计数据')
+    args = parser.parse_args()
+
+    daemon = GestureDaemon(args.socket, args.preview_fps)
+    detection_metrics = Metrics()
+    if args.metrics_port:
+        detection_metrics.enabled = True
+        detection_metrics.serve(args.metrics_port)
+    hand_detection = HandDetection(daemon, source=open_source(args.source), metrics=detection_metrics)
+    if args.profile:
+        hand_detection.load_profile(args.profile)
+    if args.motion_gate:
+        hand_detection.motion_gate = MotionGate()
+    DetectionPipeline(hand_detection).start()
+    try:
+        asyncio.run(daemon.serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # 没有启动成功（例如socket被另一个守护进程占用）时不删除别人的socket
+        if daemon.server is not None and os.path.exists(args.socket):
+            os.unlink(args.socket)
@@ -0,0 +1,277 @@
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+
+import numpy as np
+
+from contour_classifier import CentroidClassifier
+from frame_source import ImageDirSource, VideoFileSource, render_hand
+from gesture_bus import Gesture
+from hand_rec import HandDetection
+from metrics import Metrics
+
+# 合成每种手势使用的姿势(fingers, angle, thumb)，None为握拳，不应触发任何手势
+SYNTHETIC_POSES = {
+    'PLAY_PAUSE': (3, -90.0, False),
+    'CHANGE_MODE': (5, -90.0, False),
+    'NEXT': (1, 30.0, True),
+    'PREV': (1, 180.0, True),
+    'VOLUME_UP': (1, 90.0, True),
+    'VOLUME_DOWN': (1, -90.0, True),
+    None: (0, -90.0, False),
+}
+
+
+class LabelledClip:
+    # 一段带标注的帧序列，segments为(起始帧, 结束帧, 手势名)的列表，结束帧不包含在内，手势名为None表示不应触发
+    def __init__(self, name, frames, segments, frame_rate=30.0):
+        self.name = name
+        self.frames = frames  # 帧列表，或有isOpened/read/release的帧来源
+        self.segments = segments
+        self.frame_rate = frame_rate
+
+    def read_frames(self):
+        if isinstance(self.frames, list):
+            for frame in self.frames:
+                yield frame.copy()
+            return
+        source = self.frames
+        while source.isOpened():
+            ret, frame = source.read()
+            if not ret or frame is None:
+                break
+            yield frame
+        source.release()
+
+    def label_at(self, index):
+        for start, end, label in self.segments:
+            if start <= index < end:
+                return label
+        return None
+
+
+def synthetic_clip(gestures, hold=45, gap=25, variants=6, width=640, height=480, seed=0, frame_rate=30.0):
+    # 依次保持gestures中的每个手势hold帧，手势之间插入gap帧握拳
+    # 每个姿势只渲染variants张（角度和噪声不同），循环使用，避免占用过多内存
+    rng = np.random.RandomState(seed)
+    rendered = {}
+    frames, segments = [], []
+    for name in [None] + list(gestures):
+        if name not in rendered:
+            fingers, angle, thumb = SYNTHETIC_POSES[name]
+            rendered[name] = [render_hand(width, height, fingers, angle + rng.uniform(-5, 5), thumb,
+                                          scale=rng.uniform(0.9, 1.1), seed=rng.randint(1 << 30))
+                              for _ in range(variants)]
+    for name in gestures:
+        for label, count in ((None, gap), (name, hold)):
+            segments.append((len(frames), len(frames) + count, label))
+            frames.extend(rendered[label][i % variants] for i in range(count))
+    segments.append((len(frames), len(frames) + gap, None))
+    frames.extend(rendered[None][i % variants] for i in range(gap))
+    return LabelledClip('synthetic', frames, segments, frame_rate)
+
+
+def load_labels(path):
+    # 标注文件为csv，每行为 起始帧,结束帧,手势名；手势名为空或NONE表示不应触发
+    segments = []
+    with open(path, newline='') as f:
+        for row in csv.reader(f):
+            if not row or row[0].startswith('#') or not row[0].strip().isdigit():
+                continue
+            label = row[2].strip().upper() if len(row) > 2 else ''
+            if label in ('', 'NONE'):
+                label = None
+            elif label not in Gesture.__members__:
+                raise ValueError('unknown gesture label %s in %s' % (label, path))
+            segments.append((int(row[0]), int(row[1]), label))
+    return segments
+
+
+def open_clip(path):
+    # 图片文件夹使用其中的labels.csv，视频文件使用同名的csv文件
+    if os.path.isdir(path):
+        return LabelledClip(path, ImageDirSource(path), load_labels(os.path.join(path, 'labels.csv')))
+    source = VideoFileSource(path)
+    return LabelledClip(path, source, load_labels(os.path.splitext(path)[0] + '.csv'), source.fps())
+
+
+def clip_from_spec(spec, hold_ms=1500, frame_rate=30.0):
+    # synthetic[:N[:SEED]]为每个手势出现N次的合成序列，SEED不同时渲染的手不同；其余为带标注的图片文件夹或视频
+    if str(spec).startswith('synthetic'):
+        options = str(spec).split(':')[1:]
+        repeat = int(options[0]) if options and options[0] else 2
+        seed = int(options[1]) if len(options) > 1 else 0
+        # 手势保持hold_ms毫秒，间隔约0.83秒，不同帧率下时长相同
+        return synthetic_clip([g.name for g in Gesture] * repeat, hold=int(round(hold_ms * frame_rate / 1000.0)),
+                              gap=int(round(frame_rate * 5 / 6)), seed=seed, frame_rate=frame_rate)
+    return open_clip(spec)
+
+
+def tolerance_frames(params, frame_rate):
+    # 识别窗口覆盖的帧数，用作score_clip的tolerance
+    if params.get('window_ms') is None:
+        return params['window_size']
+    return int(math.ceil(params['window_ms'] * frame_rate / 1000.0))
+
+
+def replay_clip(clip, detector, metrics):
+    # 与run()相同：逐帧识别后经过识别窗口和防抖，返回(触发时的帧号, 手势事件)的列表
+    events = []
+    frame_index = [0]
+    detector.bus.subscribe(lambda event: events.append((frame_index[0], event)))
+    for i, frame in enumerate(clip.read_frames()):
+        frame_index[0] = i
+        with metrics.stage('total'):
+            res, img_rgb, frame_to_show = detector.process_adaptive(frame)
+            # 使用按帧率推算的时间戳，结果与实际处理速度无关
+            detector.handle_result(res, img_rgb, frame_to_show, i / clip.frame_rate)
+        metrics.tick()
+    return events, frame_index[0] + 1
+
+
+def score_clip(clip, events, tolerance):
+    # 识别窗口有延迟，手势结束后tolerance帧内触发的事件仍算作该手势的结果
+    segments = [list(segment) + [[]] for segment in clip.segments]
+    for frame, event in events:
+        owner = None
+        for segment in segments:
+            start, end, label, _ = segment
+            if start <= frame < end + (tolerance if label is not None else 0):
+                owner = segment
+                if label is not None:
+                    break
+        if owner is not None:
+            owner[3].append((frame, event.gesture.name))
+    return segments
+
+
+def summarize(scored, frame_rate):
+    per_gesture = {g.name: {'segments': 0, 'hits': 0, 'events': 0, 'correct': 0, 'decision_frames': []}
+                   for g in Gesture}
+    false_triggers = 0
+    for start, end, label, hits in scored:
+        if label is not None:
+            per_gesture[label]['segments'] += 1
+            correct = [frame for frame, gesture in hits if gesture == label]
+            if correct:
+                per_gesture[label]['hits'] += 1
+                per_gesture[label]['decision_frames'].append(correct[0] - start)
+        for frame, gesture in hits:
+            per_gesture[gesture]['events'] += 1
+            if gesture == label:
+                per_gesture[gesture]['correct'] += 1
+            elif label is None:
+                false_triggers += 1
+    result = {}
+    for name, item in per_gesture.items():
+        if not item['segments'] and not item['events']:
+            continue
+        decision = item.pop('decision_frames')
+        item['precision'] = item['correct'] / item['events'] if item['events'] else None
+        item['recall'] = item['hits'] / item['segments'] if item['segments'] else None
+        item['decision_ms'] = float(np.mean(decision)) * 1000.0 / frame_rate if decision else None
+        result[name] = item
+    return result, false_triggers
+
+
+def evaluate(clips, detector_factory=None, tolerance=None):
+    # 每段序列使用新的HandDetection，识别窗口和防抖状态不会跨序列残留
+    if detector_factory is None:
+        def detector_factory():
+            return HandDetection(None)
+    metrics = Metrics(enabled=True, window=None)
+    scored, frames, frame_rate = [], 0, 30.0
+    for clip in clips:
+        detector = detector_factory()
+        detector.metrics = metrics
+        if detector.adaptive is not None:
+            detector.adaptive.set_frame_rate(clip.frame_rate)
+        events, count = replay_clip(clip, detector, metrics)
+        frames += count
+        frame_rate = clip.frame_rate
+        clip_tolerance = tolerance_frames(detector.get_params(), clip.frame_rate) if tolerance is None else tolerance
+        scored.extend(score_clip(clip, events, clip_tolerance))
+    gestures, false_triggers = summarize(scored, frame_rate)
+    snapshot = metrics.snapshot()
+    total = snapshot['stages'].get('total', {})
+    seconds = total.get('mean_ms', 0.0) * total.get('count', 0) / 1000.0
+    matched = [g for g in gestures.values() if g['segments']]
+    return {
+        'frames': frames,
+        'fps': frames / seconds if seconds > 0 else 0.0,
+        'p50_ms': total.get('p50_ms', 0.0),
+        'p95_ms': total.get('p95_ms', 0.0),
+        'false_triggers': false_triggers,
+        'macro_precision': float(np.mean([g['precision'] or 0.0 for g in matched])) if matched else 0.0,
+        'macro_recall': float(np.mean([g['recall'] for g in matched])) if matched else 0.0,
+        'gestures': gestures,
+        'stages': snapshot['stages'],
+    }
+
+
+def print_report(report):
+    print('frames: %d  fps: %.1f  latency p50: %.2fms  p95: %.2fms'
+          % (report['frames'], report['fps'], report['p50_ms'], report['p95_ms']))
+    print('%-12s %8s %6s %6s %9s %7s %11s' % ('gesture', 'segments', 'hits', 'events', 'precision', 'recall',
+                                               'decision'))
+    for name, item in report['gestures'].items():
+        print('%-12s %8d %6d %6d %9s %7s %11s' % (
+            name, item['segments'], item['hits'], item['events'],
+            '-' if item['precision'] is None else '%.3f' % item['precision'],
+            '-' if item['recall'] is None else '%.3f' % item['recall'],
+            '-' if item['decision_ms'] is None else '%.0fms' % item['decision_ms']))
+    print('false triggers: %d  macro precision: %.3f  macro recall: %.3f'
+          % (report['false_triggers'], report['macro_precision'], report['macro_recall']))
+
+
+def check_report(report, min_recall=None, max_false_triggers=None, max_p95_ms=None):
+    # 返回不满足阈值的项目说明，为空时通过；召回率按每个手势分别检查
+    failures = []
+    if min_recall is not None:
+        for name, item in report['gestures'].items():
+            if item['recall'] is not None and item['recall'] < min_recall:
+                failures.append('%s recall %.3f < %.3f' % (name, item['recall'], min_recall))
+    if max_false_triggers is not None and report['false_triggers'] > max_false_triggers:
+        failures.append('false triggers %d > %d' % (report['false_triggers'], max_false_triggers))
+    if max_p95_ms is not None and report['p95_ms'] > max_p95_ms:
+        failures.append('latency p95 %.2fms > %.2fms' % (report['p95_ms'], max_p95_ms))
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='手势识别回归测试：回放带标注的帧序列，统计准确率和耗时')
+    parser.add_argument('clips', nargs='*', default=['synthetic'],
+                        help='带labels.csv的图片文件夹、带同名csv的视频或 synthetic[:N]')
+    parser.add_argument('--hold-ms', type=int, default=1500, help='合成序列中每个手势保持的毫秒数')
+    parser.add_argument('--fps', type=float, default=30.0, help='合成序列的帧率')
+    parser.add_argument('--json', default=None, help='把结果写入json文件')
+    parser.add_argument('--skin-engine', choices=('otsu', 'lut'), default='otsu', help='肤色分割方式')
+    parser.add_argument('--track', action='store_true', help='只在上一帧手部附近的窗口中分割')
+    parser.add_argument('--model', default=None, help='用gesture_classifier训练的模型代替角度规则')
+    parser.add_argument('--min-recall', type=float, default=None, help='每个手势的召回率低于该值时返回非0')
+    parser.add_argument('--max-false-triggers', type=int, default=None, help='误触发超过该次数时返回非0')
+    parser.add_argument('--max-p95-ms', type=float, default=None, help='单帧耗时的p95超过该毫秒数时返回非0')
+    args = parser.parse_args()
+
+    clip_list = [clip_from_spec(spec, args.hold_ms, args.fps) for spec in args.clips]
+
+    def make_detector():
+        hand_detection = HandDetection(None)
+        hand_detection.skin_engine = args.skin_engine
+        hand_detection.track_hand = args.track
+        if args.model:
+            hand_detection.classifier = CentroidClassifier.load(args.model)
+        return hand_detection
+
+    result = evaluate(clip_list, make_detector)
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    failed = check_report(result, args.min_recall, args.max_false_triggers, args.max_p95_ms)
+    for failure in failed:
+        print('FAIL: ' + failure)
+    sys.exit(1 if failed else 0)
@@ -1,12 +1,55 @@
 import cv2
+import json
 import math
-import queue
 
 import threading
+import time
+
+import numpy as np
+
+from frame_source import CameraSource, FramePacer, drain_source
+from gesture_bus import GestureBus, GestureEvent, gesture_from_result
+from metrics import Metrics
+from skin_lut import SkinLUT
+from vote_window import VoteWindow
+
+# 方向编号，对应DIRECTIONS中的名称
+DIRECTIONS = ('NULL', 'RIGHT', 'LEFT', 'DOWN', 'UP')
+DIRECTION_NULL, DIRECTION_RIGHT, DIRECTION_LEFT, DIRECTION_DOWN, DIRECTION_UP = range(len(DIRECTIONS))
+
+# 可以通过配置文件或传给工作进程的识别参数
+PARAM_NAMES = ('cap_region_x_begin', 'cap_region_y_end', 'blurValue', 'angle_offset_left', 'angle_offset_right',
+               'full_frame_otsu', 'skin_engine', 'sleep_frame', 'window_size', 'window_ms', 'valuable_window',
+               'valuable_frame', 'min_same_time', 'repeat_ms', 'cooldown_ms')
+
+# 按时间计算窗口时窗口中最多保存的帧数，只用于限制内存，实际由window_ms决定
+WINDOW_MAX_FRAMES = 256
+
+
+def draw_label(images, text, position, font_scale, thickness):
+    # 在调试图上标注识别出的手势，没有调试图（例如结果来自工作进程）时跳过
+    for image in images:
+        if image is not None:
+            cv2.putText(image, text, position, cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 255), thickness,
+                        cv2.LINE_AA)
+
+
+def largest_contour(contours):
+    # 把所有轮廓的点拼在一起，用鞋带公式一次算出所有轮廓的面积，返回面积最大的轮廓
+    if len(contours) == 1:
+        return contours[0]
+    lengths = np.fromiter((len(c) for c in contours), np.intp, len(contours))
+    points = np.concatenate(contours).reshape(-1, 2).astype(np.int64)
+    starts = np.cumsum(lengths) - lengths
+    following = np.arange(1, len(points) + 1)
+    following[starts + lengths - 1] = starts
+    cross = points[:, 0] * points[following, 1] - points[following, 0] * points[:, 1]
+    areas = np.abs(np.add.reduceat(cross, starts))
+    return contours[int(np.argmax(areas))]
 
 
 class HandDetection(threading.Thread):
-    def __init__(self, app):
+    def __init__(self, app, source=None, bus=None, metrics=None):
         threading.Thread.__init__(self)
         # 参数
         self.cap_region_x_begin = 0.65
@@ -14,113 +57,227 @@ class HandDetection(threading.Thread):
         self.blurValue = 41
         self.angle_offset_left = 0.25
         self.angle_offset_right = 0.5
+        # 手势分类器（contour_classifier.CentroidClassifier），为None时使用gesture_detection中的角度规则
+        self.classifier = None
+        # 是否在整帧上计算OTSU阈值，阈值与改为先裁剪之前保持一致，代价是多一次整帧的双边滤波和颜色转换
+        self.full_frame_otsu = False
+        # 肤色分割方式：'otsu'每帧求阈值并做大核高斯模糊，'lut'查Cr/Cb表并用开运算和方框滤波去噪
+        # 默认使用'otsu'；'lut'更快但分割结果与'otsu'不完全相同（合成帧上约五分之一的帧不一致），需要显式打开
+        self.skin_engine = 'otsu'
+        self.skin_lut = SkinLUT()
+        self.open_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+        self.last_threshold = None  # 最近一次OTSU求出的阈值
+        # 跟踪模式：只在上一帧手部附近的窗口中分割，手丢失或每隔track_full_interval帧重新搜索整个识别区域
+        # 跟踪状态在process_frame中更新，要求按帧顺序逐帧调用，DetectionPipeline有多个处理线程时会关闭跟踪
+        self.track_hand = False
+        self.track_margin = 0.3  # 窗口相对手部外接矩形每边扩展的比例
+        self.track_min_area = 0.02  # 手部轮廓至少占识别区域的比例
+        self.track_full_interval = 30
+        self.track_box = None
+        self.track_frames = 0
+        # 自适应质量控制（AdaptiveController），为None时始终按原分辨率处理每一帧
+        self.adaptive = None
+        # 运动检测（MotionGate），识别区域静止时不做识别并降低采集频率，为None时每一帧都识别
+        self.motion_gate = None
 
+        # 以下三组参数各有按毫秒和按帧数两种设置，毫秒的参数不为None时使用毫秒，与摄像头帧率无关
+        # 默认值与原来30帧/秒下的帧数相同
         self.sleep_frame = 20
+        self.cooldown_ms = 667  # 触发手势后的冷却时间
 
         # 共享变量
-        self.detection_res = queue.Queue()
         self.window_size = 10  # 根据最近10帧判断手势
+        self.window_ms = 333  # 根据最近333毫秒内的帧判断手势
         self.valuable_window = 0.8  # 有用的窗口至少占比
         self.valuable_frame = 0.9
         self.min_same_time = 1  # 连续多次相同才认为是同一手势
+        self.repeat_ms = 33  # 窗口结果保持相同至少多少毫秒才认为是同一手势
+        self.vote_window = VoteWindow(*self.window_shape())
+
+        # 防抖状态
+        self.last_direction = ""
+        self.last_finger = 0
+        self.finger_cnt = 0
+        self.direction_cnt = 0
+        self.finger_since = None  # 窗口结果变为last_finger的时间
+        self.direction_since = None
+        self.frame_cnt = 0  # 触发手势后还需跳过的帧数
+        self.cooldown_until = 0.0  # 冷却结束的时间
 
         self.music_app = app
+        # 识别出的手势发布到总线上，播放器作为订阅者
+        self.bus = bus if bus is not None else GestureBus()
+        if app is not None:
+            self.bus.subscribe(app.post_gesture)
+        # 帧来源，默认使用摄像头0，也可以是视频文件、图片文件夹或合成帧
+        self.source = source
+        self.source_name = None  # 多路来源时写入手势事件，用于区分事件来自哪一路
+        # 各阶段耗时统计，默认关闭，可以在运行时打开
+        self.metrics = metrics if metrics is not None else Metrics()
+
+    def get_params(self):
+        return {name: getattr(self, name) for name in PARAM_NAMES}
+
+    def set_params(self, params):
+        for name, value in params.items():
+            if name not in PARAM_NAMES:
+                raise KeyError('unknown detector parameter: %s' % name)
+            setattr(self, name, value)
+
+    def load_profile(self, path):
+        # 读取调参工具生成的配置文件
+        with open(path) as f:
+            profile = json.load(f)
+        self.set_params(profile.get('params', profile))
+        return profile
 
-    def skin_detection(self, detect_img):
+    def roi_view(self, frame):
+        # 识别区域在未翻转的原图中的位置，不复制像素
+        y_end = int(self.cap_region_y_end * frame.shape[0])
+        x_end = frame.shape[1] - int(self.cap_region_x_begin * frame.shape[1])
+        return frame[0:y_end, 0:x_end]
+
+    def crop_roi(self, frame):
+        # 先裁剪再翻转：翻转后右侧的识别区域对应原图左侧，只复制识别区域的像素
+        return cv2.flip(self.roi_view(frame), 1)
+
+    def gate_frame(self, frame, now=None):
+        # 返回这一帧是否需要识别；刚唤醒时清空识别窗口，丢掉休眠前的旧结果
+        awake, woke = self.gate_update(frame, now)
+        if woke:
+            self.reset_window()
+        return awake
+
+    def gate_update(self, frame, now=None):
+        # 返回(这一帧是否需要识别, 是否刚刚唤醒)，不修改识别窗口，供识别窗口在其他线程中的调用者使用
+        gate = self.motion_gate
+        if gate is None:
+            return True, False
+        metrics = self.metrics
+        with metrics.stage('motion_gate'):
+            awake, woke = gate.update(self.roi_view(frame), now)
+        metrics.gauge('motion_awake', int(awake))
+        if woke:
+            metrics.count('motion_wakeups')
+            metrics.record('wake_latency', gate.last_wake_latency * 1000.0)
+        if not awake:
+            metrics.count('gated_frames')
+        return awake, woke
+
+    def otsu_threshold(self, frame):
+        # 与改为先裁剪之前相同：在双边滤波后的整帧cr通道上求OTSU阈值
+        filtered = cv2.bilateralFilter(frame, 5, 50, 100)
+        cr = cv2.extractChannel(cv2.cvtColor(filtered, cv2.COLOR_BGR2YCrCb), 1)
+        cr = cv2.GaussianBlur(cr, (5, 5), 0)
+        threshold, _ = cv2.threshold(cr, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        return threshold
+
+    def scaled_blur(self, scale):
+        # 缩小图像时按比例缩小模糊核，保证核的大小为奇数
+        if scale >= 1.0:
+            return self.blurValue
+        return max(3, int(self.blurValue * scale) // 2 * 2 + 1)
+
+    def skin_detection(self, detect_img, threshold=None, blur_value=None):
+        if blur_value is None:
+            blur_value = self.blurValue
         # 把图像转换到YUV色域
         ycrcb = cv2.cvtColor(detect_img, cv2.COLOR_BGR2YCrCb)
+        if self.skin_engine == 'lut' and self.skin_lut.begin_frame():
+            # 查表分割，结果没有经过滤波，先用开运算去掉零散的点
+            skin = cv2.morphologyEx(self.skin_lut.classify(ycrcb), cv2.MORPH_OPEN, self.open_kernel)
+            # 用方框滤波代替大核高斯模糊，耗时与核的大小无关；方框核取一半大小，膨胀的范围与高斯模糊接近
+            box = blur_value // 2 | 1
+            skin = cv2.blur(skin, (box, box))
+            _, skin = cv2.threshold(skin, 40, 255, cv2.THRESH_BINARY)
+            return skin
         (y, cr, cb) = cv2.split(ycrcb)
         # 高斯滤波
         cr1 = cv2.GaussianBlur(cr, (5, 5), 0)  # 对cr通道分量进行高斯滤波
-        # 根据OTSU算法求图像阈值
-        _, skin = cv2.threshold(cr1, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        if threshold is None:
+            # 根据OTSU算法求图像阈值
+            self.last_threshold, skin = cv2.threshold(cr1, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        else:
+            _, skin = cv2.threshold(cr1, threshold, 255, cv2.THRESH_BINARY)
+        if self.skin_engine == 'lut':
+            # 用OTSU的结果校准查找表
+            self.skin_lut.calibrate(cr, cb, skin)
         # 对识别后图像模糊化，减少误差
-        skin = cv2.GaussianBlur(skin, (self.blurValue, self.blurValue), 0)
+        skin = cv2.GaussianBlur(skin, (blur_value, blur_value), 0)
         _, skin = cv2.threshold(skin, 40, 255, cv2.THRESH_BINARY)
 
         return skin
 
     def angle_around(self, angle, benchmark):
-        return benchmark - self.angle_offset_left <= angle <= benchmark + self.angle_offset_right
+        # angle可以是单个角度或numpy数组
+        return (benchmark - self.angle_offset_left <= angle) & (angle <= benchmark + self.angle_offset_right)
 
     def gesture_detection(self, max_contour, drawing, frame):  # -> finished bool, cnt: finger count
         #  找到凸包
         hull = cv2.convexHull(max_contour, returnPoints=False)
-        direction = "NOT_FOUND"
         if len(hull) > 3:
             defects = cv2.convexityDefects(max_contour, hull)
             if defects is not None:
-                fingers = 0
-                state = {"direction": 'NOT_FOUND', "point": '', "area": 0}
-                max_area = -1
-                for i in range(defects.shape[0]):
-                    # 找到缺陷三角形
-                    s, e, f, d = defects[i][0]
-                    start = tuple(max_contour[s][0])
-                    end = tuple(max_contour[e][0])
-                    far = tuple(max_contour[f][0])
-
-                    far_len = math.sqrt((end[0] - start[0]) ** 2 + (end[1] - start[1]) ** 2)
-                    end_len = math.sqrt((far[0] - start[0]) ** 2 + (far[1] - start[1]) ** 2)
-                    start_len = math.sqrt((end[0] - far[0]) ** 2 + (end[1] - far[1]) ** 2)
-
-                    # 计算三个角的度数
-                    angle_far = math.acos((end_len ** 2 + start_len ** 2 - far_len ** 2) / (2 * end_len * start_len))
-                    angle_end = math.acos((far_len ** 2 + start_len ** 2 - end_len ** 2) / (2 * far_len * start_len))
-                    angle_start = math.acos((end_len ** 2 + far_len ** 2 - start_len ** 2) / (2 * far_len * end_len))
-
-                    if angle_end < angle_start:
-                        point = end
-                    else:
-                        point = start
-
-                    # 认为far顶点的角小于90度的话就是是两个手指的夹角
-                    if angle_far <= math.pi / 2:
-                        fingers += 1
-                        cv2.circle(drawing, far, 8, [211, 84, 0], -1)
-
-                    # 根据长直角边的斜率以及坐标大小关系来判断四指方向
-                    if self.angle_around(angle_far, math.pi / 2):
-                        if point[0] > far[0] and (point[0] == far[0] or -1 <= (point[1] - far[1]) / (point[0] - far[0])
-                                                  <= 1):
-                            direction = "RIGHT"
-                        elif point[0] < far[0] and (point[0] == far[0] or -1 <= (point[1] - far[1]) / (point[0] - far[0])
-                                                    <= 1):
-                            direction = "LEFT"
-                        elif point[1] > far[1] and (point[0] == far[0] or (point[1] - far[1]) / (point[0] - far[0]) <= -1
-                                                    or (point[1] - far[1]) / (point[0] - far[0])) >= 1:
-                            direction = "DOWN"
-                        elif point[1] < far[1] and (point[0] == far[0] or (point[1] - far[1]) / (point[0] - far[0]) <= -1
-                                                    or (point[1] - far[1]) / (point[0] - far[0])) >= 1:
-                            direction = "UP"
-                        else:
-                            direction = "NULL"
-
-                    # 只保留面积最大的缺陷三角形的数据
-                    area = math.fabs(start[0] * far[1] + end[0] * start[1] + far[0] * end[1] - start[0] * end[1] - end[0]
-                                     * far[1] - far[0] * start[1])
-                    if area > max_area:
-                        max_area = area
-                        state["direction"] = direction
-                        state['point'] = point
-                        state['area'] = area
-                return True, fingers, state['direction'] if state['area'] == max_area else 'NOT_FOUND'
+                # 一次取出所有缺陷三角形的三个顶点
+                points = max_contour[:, 0, :].astype(np.int64)
+                start = points[defects[:, 0, 0]]
+                end = points[defects[:, 0, 1]]
+                far = points[defects[:, 0, 2]]
+
+                far_len = np.sqrt(((end - start) ** 2).sum(axis=1))
+                end_len = np.sqrt(((far - start) ** 2).sum(axis=1))
+                start_len = np.sqrt(((end - far) ** 2).sum(axis=1))
+
+                # 计算三个角的度数，退化的三角形得到nan，不参与任何判断
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    angle_far = np.arccos(np.clip((end_len ** 2 + start_len ** 2 - far_len ** 2) /
+                                                  (2 * end_len * start_len), -1, 1))
+                    angle_end = np.arccos(np.clip((far_len ** 2 + start_len ** 2 - end_len ** 2) /
+                                                  (2 * far_len * start_len), -1, 1))
+                    angle_start = np.arccos(np.clip((end_len ** 2 + far_len ** 2 - start_len ** 2) /
+                                                    (2 * far_len * end_len), -1, 1))
+
+                point = np.where((angle_end < angle_start)[:, None], end, start)
+
+                # 认为far顶点的角小于90度的话就是是两个手指的夹角
+                is_finger = angle_far <= math.pi / 2
+                fingers = int(np.count_nonzero(is_finger))
+                for x, y in far[is_finger]:
+                    cv2.circle(drawing, (int(x), int(y)), 8, [211, 84, 0], -1)
+
+                # 根据长直角边的斜率以及坐标大小关系来判断四指方向，斜率在[-1, 1]之间为左右，否则为上下
+                dx = point[:, 0] - far[:, 0]
+                dy = point[:, 1] - far[:, 1]
+                direction = np.select([(dx > 0) & (np.abs(dy) <= dx), (dx < 0) & (np.abs(dy) <= -dx), dy > 0, dy < 0],
+                                      [DIRECTION_RIGHT, DIRECTION_LEFT, DIRECTION_DOWN, DIRECTION_UP],
+                                      DIRECTION_NULL)
+                # 夹角不在90度附近的缺陷沿用前一个缺陷判断出的方向
+                around = self.angle_around(angle_far, math.pi / 2)
+                last_around = np.maximum.accumulate(np.where(around, np.arange(len(around)), -1))
+
+                # 只保留面积最大的缺陷三角形的数据
+                area = np.abs(start[:, 0] * far[:, 1] + end[:, 0] * start[:, 1] + far[:, 0] * end[:, 1] -
+                              start[:, 0] * end[:, 1] - end[:, 0] * far[:, 1] - far[:, 0] * start[:, 1])
+                best = last_around[int(np.argmax(area))]
+                return True, fingers, DIRECTIONS[direction[best]] if best >= 0 else 'NOT_FOUND'
         return False, 0, None
 
-    def contour_detection(self, detect_img, drawing):
-        contours, hierarchy = cv2.findContours(detect_img, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-        length = len(contours)
-        max_area = -1
-        if length > 0:
+    def gesture_result(self, max_contour, drawing, frame):
+        # 单帧的识别结果，进入识别窗口投票；设置了classifier时由分类器代替角度规则
+        if self.classifier is not None:
+            return self.classifier.classify(max_contour, drawing)
+        is_finish_cal, cnt, pose = self.gesture_detection(max_contour, drawing, frame)
+        if is_finish_cal:
+            return {"detected": True, "fingers": cnt + 1, "direction": pose}
+        return {"detected": False, "fingers": cnt, "direction": pose}
+
+    def contour_detection(self, detect_img, drawing, offset=(0, 0)):
+        # 面积最大的轮廓一定是外轮廓，只取外轮廓即可；offset为detect_img在drawing中的位置
+        contours, hierarchy = cv2.findContours(detect_img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE,
+                                               offset=offset)
+        if len(contours) > 0:
             # 只找面积最大的多边形
-            for i in range(length):
-                temp = contours[i]
-                area = cv2.contourArea(temp)
-                if area > max_area:
-                    max_area = area
-                    ci = i
-
-            contour_res = contours[ci]
+            contour_res = largest_contour(contours)
             hull = cv2.convexHull(contour_res)
             # 绘制边界和凸包，用于调试
             cv2.drawContours(drawing, [contour_res], 0, (0, 255, 0), 2)
@@ -128,110 +285,229 @@ class HandDetection(threading.Thread):
             return contour_res
         return None
 
-    def window_rec(self, res_list):
-        if len(res_list) < self.window_size:
+    def tracking_window(self, shape, blur_value):
+        # 上一帧手部外接矩形向外扩展后的窗口(x0, y0, x1, y1)，需要在整个识别区域中搜索时返回None
+        if not self.track_hand or self.track_box is None or self.track_frames >= self.track_full_interval:
             return None
-        fingers_map = {0: 0, 1: 0, 2: 0, 3: 0, 4: 0, 5: 0, 6: 0}
-        directions_map = {"NULL": 0, "LEFT": 0, "RIGHT": 0, "UP": 0, "DOWN": 0, 'NOT_FOUND': 0}
-        t_cnt = 0
-        for item in res_list:
-            if item["detected"]:
-                fingers_map[item["fingers"]] = fingers_map[item["fingers"]] + 1
-                directions_map[item["direction"]] = directions_map[item["direction"]] + 1
-                t_cnt += 1
-        if t_cnt >= self.valuable_window * self.window_size:
-            f_max = sorted(fingers_map.items(), key=lambda x: x[1], reverse=True)[0]
-            d_max = sorted(directions_map.items(), key=lambda x: x[1], reverse=True)[0]
-            return {'fingers': f_max[0] if f_max[1] > self.window_size * self.valuable_window * self.valuable_frame else None,
-                    'direction': d_max[0] if d_max[1] > self.window_size * self.valuable_window * self.valuable_frame else None}
-        return None
+        h, w = shape[:2]
+        bx0, by0, bx1, by1 = self.track_box
+        # 扩展的宽度不小于模糊核，窗口边缘的模糊结果与整区域处理时一致
+        margin_x = max(int((bx1 - bx0) * w * self.track_margin), blur_value)
+        margin_y = max(int((by1 - by0) * h * self.track_margin), blur_value)
+        x0, y0 = max(0, int(bx0 * w) - margin_x), max(0, int(by0 * h) - margin_y)
+        x1, y1 = min(w, int(bx1 * w) + margin_x), min(h, int(by1 * h) + margin_y)
+        if (x1 - x0) * (y1 - y0) > 0.7 * w * h:
+            return None
+        return x0, y0, x1, y1
 
-    def run(self):
-        camera = cv2.VideoCapture(0)
-        camera.set(10, 10)
+    def update_track(self, contour, shape, window):
+        # 记录手部外接矩形（相对识别区域的比例，与缩放无关），手太小或丢失时下一帧重新全区域搜索
+        if not self.track_hand:
+            return
+        h, w = shape[:2]
+        if contour is None or cv2.contourArea(contour) < self.track_min_area * w * h:
+            self.track_box = None
+            return
+        x, y, bw, bh = cv2.boundingRect(contour)
+        self.track_box = (x / w, y / h, (x + bw) / w, (y + bh) / h)
+        self.track_frames = 0 if window is None else self.track_frames + 1
 
-        last_direction = ""
-        last_finger = 0
-        finger_cnt = 0
-        direction_cnt = 0
+    def window_shape(self):
+        # 识别窗口的(最多帧数, 时长秒数)
+        if self.window_ms is None:
+            return self.window_size, None
+        return WINDOW_MAX_FRAMES, self.window_ms / 1000.0
 
-        frame_cnt = 0
-        while camera.isOpened():
-            ret, frame = camera.read()
-            frame = cv2.bilateralFilter(frame, 5, 50, 100)
-            frame = cv2.flip(frame, 1)
-            if frame is None:
-                continue
+    def reset_window(self):
+        self.vote_window = VoteWindow(*self.window_shape())
+
+    def window_rec(self, now=None):
+        return self.vote_window.vote(self.valuable_window, self.valuable_frame, now)
 
-            frame_to_show = frame[0:int(self.cap_region_y_end * frame.shape[0]), int(self.cap_region_x_begin *
-                                                                                     frame.shape[1]):frame.shape[1]]
-            # 肤色检测
-            img = self.skin_detection(frame)
-            # 将手部图像切下来
-            img = img[0:int(self.cap_region_y_end * frame.shape[0]), int(self.cap_region_x_begin * frame.shape[1]):frame.shape[1]]
+    def process_frame(self, frame, scale=1.0):
+        # 只对识别区域做滤波和肤色检测，返回单帧的识别结果、调试图和区域原图
+        # scale小于1时先缩小识别区域再分割，调试图再放大回识别区域的尺寸
+        metrics = self.metrics
+        with metrics.stage('bilateral'):
+            threshold = self.otsu_threshold(frame) if self.full_frame_otsu else None
+            roi = self.crop_roi(frame)
+            if scale < 1.0:
+                roi_size = (roi.shape[1], roi.shape[0])
+                roi = cv2.resize(roi, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            blur_value = self.scaled_blur(scale)
+            window = self.tracking_window(roi.shape, blur_value)
+            if window is None:
+                frame_to_show = detect_img = cv2.bilateralFilter(roi, 5, 50, 100)
+            else:
+                # 只处理上一帧手部附近的窗口，沿用整区域搜索时的OTSU阈值
+                x0, y0, x1, y1 = window
+                detect_img = cv2.bilateralFilter(roi[y0:y1, x0:x1], 5, 50, 100)
+                frame_to_show = roi
+                frame_to_show[y0:y1, x0:x1] = detect_img
+                if threshold is None:
+                    threshold = self.last_threshold
+        # 肤色检测
+        with metrics.stage('skin_detection'):
+            skin = self.skin_detection(detect_img, threshold, blur_value)
+            if window is None:
+                img = skin
+            else:
+                img = np.zeros(roi.shape[:2], np.uint8)
+                img[y0:y1, x0:x1] = skin
             # 灰度转RGB，用于绘制调试用图
-            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            # 边界检测
-            res = self.contour_detection(img, img_rgb)
+            img_rgb = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        # 边界检测
+        with metrics.stage('contour_detection'):
+            if window is None:
+                res = self.contour_detection(img, img_rgb)
+            else:
+                res = self.contour_detection(skin, img_rgb, (x0, y0))
+            self.update_track(res, roi.shape, window)
+        if res is not None:
             # 匹配手势
-            if res is not None:
-                is_finish_cal, cnt, pose = self.gesture_detection(res, img_rgb, frame)
-                if is_finish_cal:
-                    self.detection_res.put({"detected": True, "fingers": cnt + 1, "direction": pose})
-                else:
-                    self.detection_res.put({"detected": False, "fingers": cnt, "direction": pose})
-                # 处理识别窗口
-                while len(self.detection_res.queue) > self.window_size:
-                    self.detection_res.get()
-                final_pose = self.window_rec(list(self.detection_res.queue))
-                if final_pose:
-                    # print(final_pose)
-                    final_finger, final_direction = None, None
-                    if final_pose['fingers'] == last_finger:
-                        finger_cnt += 1
-                        if finger_cnt >= self.min_same_time:
-                            final_finger = last_finger
-                            finger_cnt = 0
-                    last_finger = final_pose['fingers']
-                    if final_pose['direction'] == last_direction:
-                        direction_cnt += 1
-                        if direction_cnt >= self.min_same_time:
-                            final_direction = last_direction
-                            direction_cnt = 0
-                    last_direction = final_pose['direction']
-                    if frame_cnt == 0:
-                        flag = False
-                        if final_finger is not None:
-                            flag = True
-                        if final_finger == 5:
-                            cv2.putText(img_rgb, "CHANGE_PLAY_MODE", (0, 100), cv2.FONT_HERSHEY_SIMPLEX, 1,
-                                        (0, 0, 255), 2, cv2.LINE_AA)
-                            cv2.putText(frame_to_show, "CHANGE_PLAY_MODE", (0, 100), cv2.FONT_HERSHEY_SIMPLEX, 1,
-                                        (0, 0, 255), 2, cv2.LINE_AA)
-                        if final_finger == 3:
-                            cv2.putText(img_rgb, "PLAY_OR_PAUSE", (0, 100), cv2.FONT_HERSHEY_SIMPLEX, 1,
-                                        (0, 0, 255), 2, cv2.LINE_AA)
-                            cv2.putText(frame_to_show, "PLAY_OR_PAUSE", (0, 100), cv2.FONT_HERSHEY_SIMPLEX, 1,
-                                        (0, 0, 255), 2, cv2.LINE_AA)
-                        if (final_direction is not None) and (final_direction != 'NOT_FOUND'):
-                            cv2.putText(img_rgb, str(final_direction), (0, 50), cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 0, 255)
-                                        , 3, cv2.LINE_AA)
-                            cv2.putText(frame_to_show, str(final_direction), (0, 50), cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 0, 255)
-                                        , 3, cv2.LINE_AA)
-                            flag = True
-                        # 重置跳过的帧
-                        if flag:
-                            frame_cnt = self.sleep_frame
-                            self.music_app.set_rec_res({"set": True, "used": False, "fingers": final_finger,
-                                                        "direction": final_direction})
-                    else:
-                        frame_cnt -= 1
-
-            self.music_app.convert_image(img_rgb)
-            # self.music_app.convert_image(frame_to_show)
-            cv2.waitKey(10)
+            with metrics.stage('gesture_detection'):
+                res = self.gesture_result(res, img_rgb, frame_to_show)
+        if scale < 1.0:
+            img_rgb = cv2.resize(img_rgb, roi_size, interpolation=cv2.INTER_NEAREST)
+        return res, img_rgb, frame_to_show
+
+    def process_adaptive(self, frame):
+        # 按自适应控制器给出的比例处理，并把耗时反馈给控制器
+        if self.adaptive is None:
+            return self.process_frame(frame)
+        start = time.perf_counter()
+        result = self.process_frame(frame, self.adaptive.scale())
+        self.adaptive.update(time.perf_counter() - start)
+        return result
+
+    def repeat_by_frames(self, final_pose):
+        # 窗口结果连续min_same_time次与上一次相同才输出
+        final_finger, final_direction = None, None
+        if final_pose['fingers'] == self.last_finger:
+            self.finger_cnt += 1
+            if self.finger_cnt >= self.min_same_time:
+                final_finger = self.last_finger
+                self.finger_cnt = 0
+        self.last_finger = final_pose['fingers']
+        if final_pose['direction'] == self.last_direction:
+            self.direction_cnt += 1
+            if self.direction_cnt >= self.min_same_time:
+                final_direction = self.last_direction
+                self.direction_cnt = 0
+        self.last_direction = final_pose['direction']
+        return final_finger, final_direction
+
+    def repeat_by_time(self, final_pose, now):
+        # 窗口结果保持相同repeat_ms毫秒以上才输出，输出后重新计时
+        final_finger, final_direction = None, None
+        repeat = self.repeat_ms / 1000.0 - 1e-6  # 容许帧时间戳的浮点误差
+        if final_pose['fingers'] != self.last_finger or self.finger_since is None:
+            self.finger_since = now
+        elif now - self.finger_since >= repeat:
+            final_finger = self.last_finger
+            self.finger_since = now
+        self.last_finger = final_pose['fingers']
+        if final_pose['direction'] != self.last_direction or self.direction_since is None:
+            self.direction_since = now
+        elif now - self.direction_since >= repeat:
+            final_direction = self.last_direction
+            self.direction_since = now
+        self.last_direction = final_pose['direction']
+        return final_finger, final_direction
+
+    def handle_result(self, res, img_rgb, frame_to_show, captured_at=None):
+        # 按帧顺序调用：更新识别窗口和防抖计数，触发手势时发布并返回手势事件
+        if res is None:
+            return None
+        # 窗口、重复和冷却都按帧的采集时间计算
+        now = time.perf_counter() if captured_at is None else captured_at
+        if self.motion_gate is not None and res['detected']:
+            self.motion_gate.keep_awake(now)
+        # 处理识别窗口，窗口参数被修改后重新建立窗口
+        size, duration = self.window_shape()
+        if self.vote_window.size != size or self.vote_window.duration != duration:
+            self.reset_window()
+        with self.metrics.stage('window_rec'):
+            self.vote_window.push(res, now)
+            final_pose = self.window_rec(now)
+        if not final_pose:
+            return None
+        # print(final_pose)
+        if self.repeat_ms is None:
+            final_finger, final_direction = self.repeat_by_frames(final_pose)
+        else:
+            final_finger, final_direction = self.repeat_by_time(final_pose, now)
+        if self.cooldown_ms is None:
+            if self.frame_cnt != 0:
+                self.frame_cnt -= 1
+                return None
+        elif now < self.cooldown_until:
+            return None
+        flag = False
+        if final_finger is not None:
+            flag = True
+        if final_finger == 5:
+            draw_label((img_rgb, frame_to_show), "CHANGE_PLAY_MODE", (0, 100), 1, 2)
+        if final_finger == 3:
+            draw_label((img_rgb, frame_to_show), "PLAY_OR_PAUSE", (0, 100), 1, 2)
+        if (final_direction is not None) and (final_direction != 'NOT_FOUND'):
+            draw_label((img_rgb, frame_to_show), str(final_direction), (0, 50), 2, 3)
+            flag = True
+        if not flag:
+            return None
+        # 重置跳过的帧
+        self.frame_cnt = self.sleep_frame
+        if self.cooldown_ms is not None:
+            self.cooldown_until = now + self.cooldown_ms / 1000.0
+        gesture = gesture_from_result(final_finger, final_direction)
+        if gesture is None:
+            return None
+        event = GestureEvent(gesture, final_finger, final_direction, now, self.source_name)
+        self.bus.publish(event)
+        return event
+
+    def run(self):
+        camera = self.source if self.source is not None else CameraSource(0)
+        if self.adaptive is not None:
+            self.adaptive.set_frame_rate(camera.fps())
+
+        metrics = self.metrics
+        pacer = FramePacer.for_source(camera)
+        while camera.isOpened():
+            pacer.wait()
+            with metrics.stage('capture'):
+                ret, frame = camera.read()
+            if not ret or frame is None:
+                continue
+            captured_at = time.perf_counter()
+            awake, woke = self.gate_update(frame, captured_at)
+            if woke:
+                self.reset_window()
+                drain_source(camera)
+            if not awake:
+                # 没有人时只更新预览，并降低采集频率
+                if self.music_app is not None:
+                    self.music_app.convert_image(self.crop_roi(frame))
+                time.sleep(self.motion_gate.frame_interval())
+                continue
+            if self.adaptive is not None and self.adaptive.should_skip():
+                metrics.count('skipped_frames')
+                continue
+
+            with metrics.stage('total'):
+                res, img_rgb, frame_to_show = self.process_adaptive(frame)
+                self.handle_result(res, img_rgb, frame_to_show, captured_at)
+
+            if self.music_app is not None:
+                with metrics.stage('convert_image'):
+                    self.music_app.convert_image(img_rgb)
+                # self.music_app.convert_image(frame_to_show)
+            metrics.tick()
+        camera.release()
 
 
 if __name__ == '__main__':
+    # 不带界面运行，识别出的手势打印到终端
     hd = HandDetection(None)
+    hd.bus.subscribe(print)
     hd.run()
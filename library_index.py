@@ -0,0 +1,188 @@
+import os
+import sqlite3
+import time
+
+from PyQt5 import QtCore
+from PyQt5.QtCore import QThread
+
+try:
+    import mutagen
+except ImportError:  # 没有安装mutagen时只记录文件名，不读取标签和时长
+    mutagen = None
+
+AUDIO_SUFFIXES = ('.mp3', '.ogg', '.wav', '.m4a')
+DEFAULT_DB = os.path.join(os.path.expanduser('~'), '.gesture_tunes', 'library.db')
+
+
+def read_tags(path):
+    # 返回(title, artist, album, duration)，读不到的标签为空字符串，时长为0
+    title = os.path.splitext(os.path.basename(path))[0]
+    artist, album, duration = '', '', 0.0
+    if mutagen is None:
+        return title, artist, album, duration
+    try:
+        audio = mutagen.File(path, easy=True)
+    except Exception:  # 损坏或不支持的文件仍然加入列表
+        return title, artist, album, duration
+    if audio is None:
+        return title, artist, album, duration
+    tags = audio.tags or {}
+
+    def first(name):
+        try:
+            values = tags.get(name)
+        except Exception:
+            return ''
+        return str(values[0]) if values else ''
+
+    title = first('title') or title
+    artist = first('artist')
+    album = first('album')
+    if audio.info is not None:
+        duration = float(getattr(audio.info, 'length', 0.0) or 0.0)
+    return title, artist, album, duration
+
+
+def scan_files(root):
+    # 递归遍历root，返回(path, mtime, size)；用scandir避免对每个文件再调用stat
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        try:
+            entries = sorted(os.scandir(folder), key=lambda e: e.name)
+        except OSError:
+            continue
+        sub_folders = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    sub_folders.append(entry.path)
+                elif entry.name.lower().endswith(AUDIO_SUFFIXES):
+                    stat = entry.stat()
+                    yield entry.path, stat.st_mtime, stat.st_size
+            except OSError:
+                continue
+        # 倒序入栈，按文件名顺序遍历子文件夹
+        stack.extend(reversed(sub_folders))
+
+
+def scan_key(root, path):
+    # 与scan_files相同的顺序：同一文件夹中先按文件名排列文件，再依次进入子文件夹
+    parts = os.path.relpath(path, root).split(os.sep)
+    return tuple((1, name) for name in parts[:-1]) + ((0, parts[-1]),)
+
+
+class LibraryCache:
+    # 曲目信息的SQLite缓存，以路径为主键，mtime和size不变时不再读取标签
+    # sqlite3的连接只能在创建它的线程中使用，每个线程各自创建LibraryCache
+    def __init__(self, path=DEFAULT_DB):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS tracks (path TEXT PRIMARY KEY, mtime REAL, size INTEGER, '
+                        'title TEXT, artist TEXT, album TEXT, duration REAL)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)')
+        self.db.commit()
+
+    def tracks_under(self, root):
+        # 按扫描顺序返回root下的所有曲目：(path, mtime, size, title, artist, album, duration)
+        # 重启后从缓存恢复的播放列表与重新扫描得到的顺序相同
+        prefix = os.path.join(root, '')
+        rows = self.db.execute('SELECT path, mtime, size, title, artist, album, duration FROM tracks '
+                               'WHERE substr(path, 1, ?) = ?', (len(prefix), prefix)).fetchall()
+        return sorted(rows, key=lambda row: scan_key(root, row[0]))
+
+    def update(self, rows):
+        self.db.executemany('INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        self.db.commit()
+
+    def remove(self, paths):
+        self.db.executemany('DELETE FROM tracks WHERE path = ?', [(p,) for p in paths])
+        self.db.commit()
+
+    def get_setting(self, key, default=None):
+        row = self.db.execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_setting(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO settings VALUES (?, ?)', (key, value))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+class LibraryScanner(QThread):
+    # 在后台线程中扫描音乐文件夹，结果按批发给界面线程
+    # 先发出缓存中的曲目，界面可以立即显示；再遍历文件夹，只为新增或修改过的文件读取标签
+    # 曲目为(path, title, artist, album, duration)
+    tracks_added = QtCore.pyqtSignal(list)
+    tracks_updated = QtCore.pyqtSignal(list)
+    tracks_removed = QtCore.pyqtSignal(list)  # 路径列表
+    scan_finished = QtCore.pyqtSignal(int)  # 扫描结束后曲库中的曲目数
+
+    def __init__(self, root, db_path=DEFAULT_DB, batch_size=500, batch_interval=0.2, parent=None):
+        super().__init__(parent)
+        self.root = os.path.abspath(root)
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval  # 一批不满batch_size时最多等待的秒数
+
+    def run(self):
+        cache = LibraryCache(self.db_path)
+        try:
+            self.scan(cache)
+        finally:
+            cache.close()
+
+    def scan(self, cache):
+        cache.set_setting('last_root', self.root)
+        cached = {}
+        batch = []
+        for path, mtime, size, title, artist, album, duration in cache.tracks_under(self.root):
+            cached[path] = (mtime, size)
+            batch.append((path, title, artist, album, duration))
+            if len(batch) >= self.batch_size:
+                self.tracks_added.emit(batch)
+                batch = []
+        if batch:
+            self.tracks_added.emit(batch)
+
+        added, updated, rows = [], [], []
+        seen = set()
+        last_emit = time.perf_counter()
+        for path, mtime, size in scan_files(self.root):
+            if self.isInterruptionRequested():
+                return
+            seen.add(path)
+            old = cached.get(path)
+            if old == (mtime, size):
+                continue
+            track = (path,) + read_tags(path)
+            rows.append((path, mtime, size) + track[1:])
+            (added if old is None else updated).append(track)
+            now = time.perf_counter()
+            if len(rows) >= self.batch_size or now - last_emit > self.batch_interval:
+                self.flush(cache, rows, added, updated)
+                added, updated, rows = [], [], []
+                last_emit = now
+        self.flush(cache, rows, added, updated)
+
+        removed = [path for path in cached if path not in seen]
+        if removed:
+            cache.remove(removed)
+            self.tracks_removed.emit(removed)
+        self.scan_finished.emit(len(seen))
+
+    def flush(self, cache, rows, added, updated):
+        if rows:
+            cache.update(rows)
+        if added:
+            self.tracks_added.emit(added)
+        if updated:
+            self.tracks_updated.emit(updated)
+
+    def stop(self):
+        self.requestInterruption()
+        self.wait()
@@ -0,0 +1,200 @@
+import collections
+import csv
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+class NullTimer:
+    # 关闭统计时使用的空计时器，不做任何事情
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class StageTimer:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.metrics.record(self.name, (time.perf_counter() - self.start) * 1000.0)
+        return False
+
+
+def percentile(sorted_values, p):
+    # 线性插值，与numpy.percentile的默认方式相同
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100.0
+    low = int(k)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (k - low)
+
+
+class Metrics:
+    # 检测流程的性能统计：各阶段最近window次的耗时（毫秒）、帧率、计数器和瞬时值
+    # enabled为False时stage返回空计时器，其余记录函数直接返回，几乎没有开销；可以在运行时切换
+    def __init__(self, enabled=False, window=300):
+        self.enabled = enabled
+        self.window = window
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.counters = collections.Counter()
+        self.gauges = {}
+        self.frame_times = collections.deque(maxlen=window)
+        self.server = None
+
+    def stage(self, name):
+        if not self.enabled:
+            return NULL_TIMER
+        return StageTimer(self, name)
+
+    def record(self, name, value_ms):
+        if not self.enabled:
+            return
+        with self.lock:
+            values = self.latencies.get(name)
+            if values is None:
+                values = self.latencies[name] = collections.deque(maxlen=self.window)
+            values.append(value_ms)
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] += n
+
+    def gauge(self, name, value):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.gauges[name] = value
+
+    def tick(self):
+        # 每处理完一帧调用一次，用于计算帧率
+        if not self.enabled:
+            return
+        with self.lock:
+            self.frame_times.append(time.perf_counter())
+            self.counters['frames'] += 1
+
+    def reset(self):
+        with self.lock:
+            self.latencies.clear()
+            self.counters.clear()
+            self.gauges.clear()
+            self.frame_times.clear()
+
+    def fps(self):
+        with self.lock:
+            if len(self.frame_times) < 2:
+                return 0.0
+            span = self.frame_times[-1] - self.frame_times[0]
+            return (len(self.frame_times) - 1) / span if span > 0 else 0.0
+
+    def snapshot(self):
+        with self.lock:
+            latencies = {name: sorted(values) for name, values in self.latencies.items()}
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+        stages = {}
+        for name, values in latencies.items():
+            if not values:
+                continue
+            item = {'count': len(values), 'mean_ms': sum(values) / len(values)}
+            for p in PERCENTILES:
+                item['p%d_ms' % p] = percentile(values, p)
+            stages[name] = item
+        return {'timestamp': time.time(), 'fps': self.fps(), 'stages': stages, 'counters': counters,
+                'gauges': gauges}
+
+    def export_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def export_csv(self, path):
+        snapshot = self.snapshot()
+        columns = ['stage', 'count', 'mean_ms'] + ['p%d_ms' % p for p in PERCENTILES]
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for name, item in sorted(snapshot['stages'].items()):
+                writer.writerow([name] + [item[c] for c in columns[1:]])
+            for name, value in sorted(snapshot['counters'].items()):
+                writer.writerow([name, value])
+            for name, value in sorted(snapshot['gauges'].items()):
+                writer.writerow([name, value])
+
+    def prometheus_text(self):
+        snapshot = self.snapshot()
+        lines = ['# TYPE gesture_stage_latency_ms summary']
+        for name, item in sorted(snapshot['stages'].items()):
+            for p in PERCENTILES:
+                lines.append('gesture_stage_latency_ms{stage="%s",quantile="%.2f"} %.4f'
+                             % (name, p / 100.0, item['p%d_ms' % p]))
+            lines.append('gesture_stage_latency_ms_count{stage="%s"} %d' % (name, item['count']))
+        lines.append('# TYPE gesture_fps gauge')
+        lines.append('gesture_fps %.3f' % snapshot['fps'])
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append('# TYPE gesture_%s_total counter' % name)
+            lines.append('gesture_%s_total %d' % (name, value))
+        for name, value in sorted(snapshot['gauges'].items()):
+            lines.append('# TYPE gesture_%s gauge' % name)
+            lines.append('gesture_%s %s' % (name, value))
+        return '\n'.join(lines) + '\n'
+
+    def overlay_lines(self, stages=('capture', 'skin_detection', 'contour_detection', 'gesture_detection',
+                                    'total', 'gesture_to_action')):
+        # 显示在手势面板上的简短文本
+        snapshot = self.snapshot()
+        dropped = snapshot['gauges'].get('dropped_frames', snapshot['counters'].get('skipped_frames', 0))
+        lines = ['fps %.1f  dropped %d' % (snapshot['fps'], dropped)]
+        for name in stages:
+            item = snapshot['stages'].get(name)
+            if item is not None:
+                lines.append('%s %.1f/%.1fms' % (name, item['p50_ms'], item['p95_ms']))
+        return lines
+
+    def serve(self, port=9108, host='127.0.0.1'):
+        # 在本地端口上以Prometheus文本格式提供/metrics
+        if self.server is not None:
+            return self.server
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') not in ('', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, name='metrics-server', daemon=True).start()
+        return self.server
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server = None
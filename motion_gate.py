@@ -0,0 +1,84 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    # 识别区域的运动检测：把区域缩小并转为灰度，与滑动平均的背景比较，变化的像素足够多时认为有人
+    # 连续wake_frames帧有运动才唤醒识别，最后一次运动（或识别到手）之后hold_time秒内保持唤醒
+    # 休眠时采集间隔为idle_interval秒
+    def __init__(self, scale=0.125, threshold=15, min_fraction=0.01, background_rate=0.05, wake_frames=2,
+                 hold_time=3.0, idle_interval=0.2):
+        self.scale = scale
+        self.threshold = threshold  # 像素灰度变化超过该值才算变化
+        self.min_fraction = min_fraction  # 变化像素占区域的比例
+        self.background_rate = background_rate
+        self.wake_frames = wake_frames
+        self.hold_time = hold_time
+        self.idle_interval = idle_interval
+        self.lock = threading.Lock()
+        self.background = None
+        self.awake = False
+        self.active_until = 0.0
+        self.motion_frames = 0
+        self.motion_since = None
+        self.last_fraction = 0.0
+        self.last_wake_latency = None  # 从检测到运动到唤醒的秒数
+        self.wakeups = 0
+        self.gated_frames = 0
+
+    def motion_fraction(self, roi):
+        small = cv2.resize(roi, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        if self.background is None or self.background.shape != gray.shape:
+            self.background = gray.astype(np.float32)
+            return 0.0
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self.background))
+        cv2.accumulateWeighted(gray, self.background, self.background_rate)
+        return np.count_nonzero(diff > self.threshold) / float(diff.size)
+
+    def update(self, roi, now=None):
+        # 返回(是否唤醒, 是否在这一帧刚刚唤醒)
+        if now is None:
+            now = time.perf_counter()
+        with self.lock:
+            self.last_fraction = fraction = self.motion_fraction(roi)
+            if fraction >= self.min_fraction:
+                if self.motion_frames == 0:
+                    self.motion_since = now
+                self.motion_frames += 1
+                if self.motion_frames >= self.wake_frames:
+                    self.active_until = now + self.hold_time
+            else:
+                self.motion_frames = 0
+            woke = False
+            if now < self.active_until:
+                if not self.awake:
+                    self.awake = woke = True
+                    self.wakeups += 1
+                    self.last_wake_latency = now - self.motion_since if self.motion_since is not None else 0.0
+            elif self.awake:
+                self.awake = False
+            if not self.awake:
+                self.gated_frames += 1
+            return self.awake, woke
+
+    def keep_awake(self, now=None):
+        # 识别到手时调用，手静止不动时也不会休眠
+        if now is None:
+            now = time.perf_counter()
+        with self.lock:
+            if self.awake:
+                self.active_until = max(self.active_until, now + self.hold_time)
+
+    def frame_interval(self):
+        # 采集下一帧之前应等待的秒数
+        return 0.0 if self.awake else self.idle_interval
+
+    def stats(self):
+        with self.lock:
+            return {'awake': self.awake, 'motion_fraction': self.last_fraction, 'wakeups': self.wakeups,
+                    'gated_frames': self.gated_frames,
+                    'wake_latency_ms': None if self.last_wake_latency is None else self.last_wake_latency * 1000.0}
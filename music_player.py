@@ -1,20 +1,38 @@
+import collections
+import os
 import sys
+import threading
+import time
 
-import numpy as np
 from PyQt5 import QtWidgets, QtCore
-from PyQt5.QtGui import QPalette, QColor, QStandardItemModel, QStandardItem, QImage, QPixmap, QIcon
-from PyQt5.QtCore import QUrl, QDirIterator, Qt, QTimer, QCoreApplication
+from PyQt5.QtGui import QPalette, QColor, QImage, QPixmap, QIcon, QPainter
+from PyQt5.QtCore import QUrl, Qt, QCoreApplication, QBuffer, QByteArray, QIODevice
 from PyQt5.QtWidgets import QApplication, QWidget, QMainWindow, QPushButton, QFileDialog, QAction, QHBoxLayout, \
-    QVBoxLayout, QSlider, QAbstractItemView, QHeaderView, QLabel
+    QVBoxLayout, QSlider, QAbstractItemView, QHeaderView, QLabel, QLineEdit
 from PyQt5.QtMultimedia import QMediaPlaylist, QMediaPlayer, QMediaContent
-import cv2
 
+from contour_classifier import CentroidClassifier
+from frame_exchange import FrameExchange
+from gesture_bus import Gesture
+from gesture_daemon import GestureClient
+from adaptive import AdaptiveController
 from hand_rec import HandDetection
+from library_index import DEFAULT_DB, LibraryCache, LibraryScanner, read_tags
+from metrics import Metrics
+from motion_gate import MotionGate
+from pipeline import DetectionPipeline
+from playlist_model import PlaylistFilter, PlaylistModel, row_ranges
+from preloader import TrackPreloader
+from process_backend import ProcessDetectionBackend
 
 
 class MusicApp(QMainWindow):
+    # 检测线程写入新的一帧后发出，界面线程中排队执行show_frame
+    frame_ready = QtCore.pyqtSignal()
+    # 手势事件，可以从任意线程发出，在界面线程中执行对应的操作
+    gesture_received = QtCore.pyqtSignal(object)
 
-    def __init__(self):
+    def __init__(self, metrics=None):
         super().__init__()
         self.player = QMediaPlayer()
         self.playlist = QMediaPlaylist()
@@ -24,13 +42,22 @@ class MusicApp(QMainWindow):
         self.width = 600
         self.height = 340
         self.volume_initial_value = 60
-        self.model = QStandardItemModel(0, 1)
+        # 播放列表的行与QMediaPlaylist一一对应，视图通过搜索过滤后显示
+        self.model = PlaylistModel()
+        self.song_filter = PlaylistFilter()
+        self.song_filter.setSourceModel(self.model)
         self.song_list = QtWidgets.QTableView()
+        self.search_box = QLineEdit()
         self.play_btn = QPushButton('播放')
         self.media_controls = QHBoxLayout()
         # 共享变量
-        self.image_to_show = None
-        self.rec_res = {"set": False, "used": True, "direction": None, "fingers": 0}
+        self.frame_exchange = FrameExchange()
+        self.gesture_latency = collections.deque(maxlen=100)  # 最近的手势从采集到执行的延迟（毫秒）
+        # 性能统计，与检测线程共用；打开叠加层时在手势面板上显示
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.show_metrics = False
+        self.overlay_lines = []
+        self.overlay_updated = 0.0
         # 摄像头窗口
         self.widget = QWidget()
         self.widget.move(1000, 200)
@@ -41,12 +68,17 @@ class MusicApp(QMainWindow):
         self.widget.setLayout(video_area)
         video_area.addWidget(self.videoFrame)
         self.widget.show()
+        self.frame_ready.connect(self.show_frame)
+        self.gesture_received.connect(self.dispatch_gesture)
+        self.gesture_actions = {
+            Gesture.PLAY_PAUSE: self.start_or_stop,
+            Gesture.CHANGE_MODE: self.change_play_style,
+            Gesture.NEXT: self.next,
+            Gesture.PREV: self.prev,
+            Gesture.VOLUME_UP: self.volume_up,
+            Gesture.VOLUME_DOWN: self.volume_down,
+        }
         # self.widget.setWindowFlags(QtCore.Qt.WindowStaysOnTopHint)
-        # 定时器
-        self.timer = QTimer()
-        self.timer.setInterval(20)
-        self.timer.start()
-        self.timer.timeout.connect(self.show_image)
         self.have_song = False
         self.volume_slider = QSlider(Qt.Horizontal, self)
         self.volume_slider.setTracking(True)
@@ -59,9 +91,25 @@ class MusicApp(QMainWindow):
         self.play_tip = ''
 
         self.playlist.setPlaybackMode(QMediaPlaylist.Loop)
+        # 播放器不绑定播放列表：播放列表只决定顺序和播放模式，切歌时优先从预读的内存数据播放
+        # GESTURE_PRELOAD_MB设置预读缓存的大小，为0时不预读
+        preload_mb = int(os.environ.get('GESTURE_PRELOAD_MB', '256'))
+        self.preloader = TrackPreloader(max_bytes=preload_mb * 1024 * 1024) if preload_mb > 0 else None
+        self.media_buffer = None
+        self.loaded_index = -1  # 当前加载到播放器中的曲目在播放列表中的位置
+        self.invalid_skips = 0  # 连续跳过的无法播放的曲目数
+        # 曲库扫描线程
+        self.library_db = DEFAULT_DB
+        self.scanner = None
 
         # 初始化界面
         self.init_ui()
+        # 启动时从缓存中恢复上次打开的文件夹，后台再增量扫描
+        cache = LibraryCache(self.library_db)
+        last_root = cache.get_setting('last_root')
+        cache.close()
+        if last_root and os.path.isdir(last_root):
+            self.load_library(last_root)
 
     def init_ui(self):
         # Add file menu
@@ -77,6 +125,14 @@ class MusicApp(QMainWindow):
         fileAct.triggered.connect(self.open_file)
         folderAct.triggered.connect(self.add_files)
 
+        metrics_menu = menubar.addMenu('性能')
+        overlayAct = QAction('显示性能数据', self, checkable=True)
+        exportAct = QAction('导出性能数据', self)
+        metrics_menu.addAction(overlayAct)
+        metrics_menu.addAction(exportAct)
+        overlayAct.toggled.connect(self.toggle_metrics)
+        exportAct.triggered.connect(self.export_metrics)
+
         self.add_listener()
 
         self.setWindowTitle(self.title)
@@ -97,6 +153,9 @@ class MusicApp(QMainWindow):
         next_btn = QPushButton('下一首')
         # 显示播放列表
         self.set_play_list()
+        self.search_box.setPlaceholderText('搜索标题或艺术家')
+        self.search_box.setClearButtonEnabled(True)
+        self.search_box.textChanged.connect(self.song_filter.set_query)
         self.song_list.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
         self.song_list.setShowGrid(False)
         self.song_list.setTextElideMode(QtCore.Qt.ElideLeft)
@@ -114,6 +173,7 @@ class MusicApp(QMainWindow):
         self.media_controls.addWidget(self.volume_slider)
 
         # 将layout添加到界面中
+        control_area.addWidget(self.search_box)
         control_area.addWidget(self.song_list)
         control_area.addLayout(self.media_controls)
         wid.setLayout(control_area)
@@ -128,64 +188,156 @@ class MusicApp(QMainWindow):
 
         self.statusBar()
         self.playlist.currentMediaChanged.connect(self.song_changed)
+        self.playlist.currentIndexChanged.connect(self.load_current)
+        self.player.mediaStatusChanged.connect(self.media_status_changed)
 
     def set_play_list(self):
-        self.model.clear()
-        self.song_list.horizontalHeader().hide()
         # self.song_list.verticalHeader().hide()
-        # QHeaderView()
-        self.song_list.setModel(self.model)  # 把数据添加至QtableView中
-        self.song_list.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.song_list.setModel(self.song_filter)  # 视图只向模型请求可见行的数据
+        header = self.song_list.horizontalHeader()
+        # 按内容调整列宽需要遍历所有行，只让标题列拉伸
+        header.setSectionResizeMode(QHeaderView.Interactive)
+        header.setSectionResizeMode(0, QHeaderView.Stretch)
+        self.song_list.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
         self.song_list.setEditTriggers(QAbstractItemView.NoEditTriggers)  # 设置不可编辑单元格
-        if self.playlist.mediaCount():  # 添加数据
-            for index in range(self.playlist.mediaCount()):
-                self.model.appendRow([  # 添加一行数据
-                    QStandardItem(self.playlist.media(index).canonicalUrl().fileName())
-                ])
-            self.song_list.selectRow(0)
 
     def open_file(self):
         song = QFileDialog.getOpenFileName(self, "打开文件", "~", "音频文件 (*.mp3 *.ogg *.wav *.m4a)")
 
         if song[0] != '':
-            url = QUrl.fromLocalFile(song[0])
-            if self.playlist.mediaCount() == 0:
-                self.playlist.addMedia(QMediaContent(url))
-                self.player.setPlaylist(self.playlist)
+            was_empty = self.playlist.mediaCount() == 0
+            # 只追加一行，不重建整个列表
+            self.tracks_added([(song[0],) + read_tags(song[0])])
+            if was_empty:
                 self.player.play()
-            else:
-                self.playlist.addMedia(QMediaContent(url))
-        self.set_play_list()
         self.have_song = True
 
     def add_files(self):
-        if self.playlist.mediaCount() != 0:
-            self.playlist.clear()
-        self.folder_iterator()
-        self.player.setPlaylist(self.playlist)
-        self.player.playlist().setCurrentIndex(0)
-        self.song_list.selectRow(0)
-        self.set_play_list()
-        self.player.pause()
-        self.play_tip = "暂停：" + self.playlist.currentMedia().canonicalUrl().fileName()
-        self.statusBar().showMessage(self.play_tip + " - " + self.play_style)
-        self.have_song = True
-
-    def folder_iterator(self):
         folder_chosen = QFileDialog.getExistingDirectory(self, '打开文件夹', '~')
-        if folder_chosen is not None:
-            it = QDirIterator(folder_chosen)
-            it.next()
-            while it.hasNext():
-                if (not it.fileInfo().isDir()) and it.filePath() != '.':
-                    f_info = it.fileInfo()
-                    if f_info.suffix() in ('mp3', 'ogg', 'wav', 'm4a'):
-                        self.playlist.addMedia(QMediaContent(QUrl.fromLocalFile(it.filePath())))
-                it.next()
-            if (not it.fileInfo().isDir()) and it.filePath() != '.':
-                f_info = it.fileInfo()
-                if f_info.suffix() in ('mp3', 'ogg', 'wav', 'm4a'):
-                    self.playlist.addMedia(QMediaContent(QUrl.fromLocalFile(it.filePath())))
+        if folder_chosen:
+            self.load_library(folder_chosen)
+
+    def load_library(self, folder):
+        # 在后台线程中递归扫描文件夹，曲目分批加入播放列表
+        if self.scanner is not None:
+            self.scanner.stop()
+            # 旧的扫描线程已经发出、还在排队的批次不再加入新的列表
+            for signal in (self.scanner.tracks_added, self.scanner.tracks_updated, self.scanner.tracks_removed,
+                           self.scanner.scan_finished):
+                signal.disconnect()
+        self.playlist.clear()
+        self.model.clear()
+        self.scanner = LibraryScanner(folder, self.library_db)
+        self.scanner.tracks_added.connect(self.tracks_added)
+        self.scanner.tracks_updated.connect(self.tracks_updated)
+        self.scanner.tracks_removed.connect(self.tracks_removed)
+        self.scanner.scan_finished.connect(self.scan_finished)
+        self.scanner.start()
+
+    def stale_batch(self):
+        # 断开连接前已经排队的信号仍会送达，来自旧扫描线程的批次直接丢弃；open_file直接调用时没有sender
+        sender = self.sender()
+        return sender is not None and sender is not self.scanner
+
+    def tracks_added(self, tracks):
+        if self.stale_batch():
+            return
+        first_batch = self.playlist.mediaCount() == 0
+        # 一次加入一批，播放列表只发出一次插入信号
+        self.playlist.addMedia([QMediaContent(QUrl.fromLocalFile(track[0])) for track in tracks])
+        self.model.append_tracks(tracks)
+        if first_batch:
+            self.playlist.setCurrentIndex(0)
+            self.select_track(0)
+            self.play_tip = "暂停：" + self.playlist.currentMedia().canonicalUrl().fileName()
+            self.statusBar().showMessage(self.play_tip + " - " + self.play_style)
+            self.have_song = True
+
+    def tracks_updated(self, tracks):
+        if self.stale_batch():
+            return
+        self.model.update_tracks(tracks)
+
+    def tracks_removed(self, paths):
+        if self.stale_batch():
+            return
+        # 连续的行一次删除；先删模型中的行，播放列表删除当前曲目后加载新的当前曲目时两者已经一致
+        # 删除前面的行时先把已加载曲目的位置前移，播放列表发出currentIndexChanged时不会重新加载同一首
+        for first, last in row_ranges(self.model.store.rows_of(paths)):
+            if first <= self.loaded_index <= last:
+                self.loaded_index = -1
+            elif last < self.loaded_index:
+                self.loaded_index -= last - first + 1
+            self.model.remove_ranges([(first, last)])
+            self.playlist.removeMedia(first, last)
+
+    def load_current(self, index):
+        # 播放列表的当前曲目改变后加载到播放器，保持原来的播放/暂停状态
+        was_playing = self.player.state() == QMediaPlayer.PlayingState
+        if index < 0:
+            self.player.setMedia(QMediaContent())
+            self.media_buffer = None
+            self.loaded_index = -1
+            return
+        if index == self.loaded_index:
+            # 删除前面的曲目只改变了当前曲目的位置，不重新加载，只更新预读的范围
+            self.schedule_preload(index)
+            return
+        self.loaded_index = index
+        path = self.model.path(index)
+        url = QUrl.fromLocalFile(path)
+        data = self.preloader.get(path) if self.preloader is not None else None
+        if data is None:
+            self.player.setMedia(QMediaContent(url))
+            self.media_buffer = None
+        else:
+            # 从内存播放，url只用于判断格式；缓冲区在切换到下一首之前必须保持有效
+            buffer = QBuffer()
+            buffer.setData(QByteArray(data))
+            buffer.open(QIODevice.ReadOnly)
+            self.player.setMedia(QMediaContent(url), buffer)
+            self.media_buffer = buffer
+        if was_playing:
+            self.player.play()
+        else:
+            self.player.pause()
+        self.schedule_preload(index)
+
+    def schedule_preload(self, index):
+        if self.preloader is not None:
+            count = self.playlist.mediaCount()
+            self.preloader.schedule([self.model.path(i) for i in self.preloader.neighbours(index, count)])
+
+    def media_status_changed(self, status):
+        # 播放器不绑定播放列表，播放结束后按播放模式切到下一首
+        if status in (QMediaPlayer.LoadedMedia, QMediaPlayer.BufferedMedia):
+            self.invalid_skips = 0
+        elif status == QMediaPlayer.InvalidMedia:
+            # 与绑定播放列表时相同，跳过无法播放的曲目；单曲循环时也切到下一首，整个列表都无法播放时停止
+            count = self.playlist.mediaCount()
+            self.invalid_skips += 1
+            if count > 1 and self.invalid_skips < count:
+                self.playlist.setCurrentIndex((self.playlist.currentIndex() + 1) % count)
+                self.player.play()
+        elif status == QMediaPlayer.EndOfMedia:
+            index = self.playlist.currentIndex()
+            if self.playlist.playbackMode() != QMediaPlaylist.CurrentItemInLoop:
+                self.playlist.next()
+            if self.playlist.currentIndex() == index:
+                # 单曲循环或列表中只有一首时当前曲目不变，从头重新播放
+                self.player.setPosition(0)
+            self.player.play()
+
+    def select_track(self, row):
+        # row为播放列表中的位置，被搜索过滤掉时不选中
+        index = self.song_filter.mapFromSource(self.model.index(row, 0))
+        if index.isValid():
+            self.song_list.selectRow(index.row())
+
+    def scan_finished(self, count):
+        if self.stale_batch():
+            return
+        self.statusBar().showMessage('曲库中共%d首' % count, 3000)
 
     def start_or_stop(self):
         print(self.player.state())
@@ -223,7 +375,7 @@ class MusicApp(QMainWindow):
         if self.playlist.mediaCount() == 0:
             self.open_file()
         elif self.playlist.mediaCount() != 0:
-            self.player.playlist().previous()
+            self.playlist.previous()
 
     def shuffle(self):
         self.playlist.shuffle()
@@ -232,17 +384,17 @@ class MusicApp(QMainWindow):
         if self.playlist.mediaCount() == 0:
             self.open_file()
         elif self.playlist.mediaCount() != 0:
-            self.player.playlist().next()
+            self.playlist.next()
 
     def song_changed(self, media):
         if not media.isNull():
             url = media.canonicalUrl()
             self.play_tip = "正在播放：" + url.fileName()
             self.statusBar().showMessage(self.play_tip + " - " + self.play_style)
-            self.song_list.selectRow(self.playlist.currentIndex())
+            self.select_track(self.playlist.currentIndex())
 
     def change_song(self):
-        index = self.song_list.currentIndex().row()  # 获取双击所在行
+        index = self.song_filter.mapToSource(self.song_list.currentIndex()).row()  # 获取双击所在行
         self.playlist.setCurrentIndex(index)
 
     def change_play_style(self):
@@ -256,45 +408,75 @@ class MusicApp(QMainWindow):
             self.play_style_btn.setIcon(self.loop_img)
         self.statusBar().showMessage(self.play_tip + " - " + self.play_style)
 
+    def closeEvent(self, event):
+        # 退出前结束扫描线程
+        if self.scanner is not None:
+            self.scanner.stop()
+        if self.preloader is not None:
+            self.preloader.shutdown()
+        super().closeEvent(event)
+
     def convert_image(self, frame):
-        if len(frame.shape) == 2:  # 若是灰度图则转为三通道
-            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
-
-        rgb_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)  # 将BGR转为RGB
-        rgb_image = np.asanyarray(rgb_image)
-        label_image = QImage(rgb_image.data, rgb_image.shape[1], rgb_image.shape[0], QImage.Format_RGB888)  # 转化为QImage
-        self.image_to_show = QPixmap(label_image)
-
-    def show_image(self):
-        if self.image_to_show is not None:
-            self.videoFrame.setPixmap(self.image_to_show)
-        if self.rec_res['set'] and not self.rec_res['used']:
-            final_direction = self.rec_res['direction']
-            final_fingers = self.rec_res['fingers']
-            if final_fingers == 3:
-                self.start_or_stop()
-                self.rec_res['used'] = True
-                return
-            if final_fingers == 5:
-                self.change_play_style()
-                self.rec_res['used'] = True
-                return
-            if final_direction is not None and final_direction != 'NOT_FOUND':
-                if final_direction == "RIGHT":
-                    self.next()
-                    self.rec_res['used'] = True
-                if final_direction == "LEFT":
-                    self.prev()
-                    self.rec_res['used'] = True
-                if final_direction == "UP":
-                    self.volume_up()
-                    self.rec_res['used'] = True
-                if final_direction == "DOWN":
-                    self.volume_down()
-                    self.rec_res['used'] = True
-
-    def set_rec_res(self, res):
-        self.rec_res = res
+        # 在检测线程中调用，只把帧写入预分配的缓冲区，QPixmap在界面线程中创建
+        if self.frame_exchange.write(frame):
+            self.frame_ready.emit()
+
+    def show_frame(self):
+        frame = self.frame_exchange.acquire()
+        if frame is None:
+            return
+        if frame.ndim == 2:  # 灰度图直接显示，不转为三通道
+            label_image = QImage(frame.data, frame.shape[1], frame.shape[0], frame.strides[0],
+                                 QImage.Format_Grayscale8)
+        else:
+            label_image = QImage(frame.data, frame.shape[1], frame.shape[0], frame.strides[0], QImage.Format_RGB888)
+        # fromImage会复制像素，缓冲区之后可以被检测线程复用
+        pixmap = QPixmap.fromImage(label_image)
+        if self.show_metrics:
+            self.draw_metrics(pixmap)
+        self.videoFrame.setPixmap(pixmap)
+
+    def draw_metrics(self, pixmap):
+        # 统计文本每0.5秒更新一次
+        now = time.perf_counter()
+        if now - self.overlay_updated > 0.5:
+            self.overlay_lines = self.metrics.overlay_lines()
+            self.overlay_updated = now
+        painter = QPainter(pixmap)
+        painter.setPen(QColor(255, 255, 0))
+        for i, line in enumerate(self.overlay_lines):
+            painter.drawText(5, 15 + i * 15, line)
+        painter.end()
+
+    def toggle_metrics(self, checked):
+        # 统计只在需要时打开，关闭时检测线程几乎没有额外开销
+        self.show_metrics = checked
+        if self.metrics.server is None:
+            self.metrics.enabled = checked
+            if not checked:
+                self.metrics.reset()
+
+    def export_metrics(self):
+        path, _ = QFileDialog.getSaveFileName(self, "导出性能数据", "metrics.json", "JSON (*.json);;CSV (*.csv)")
+        if path == '':
+            return
+        if path.endswith('.csv'):
+            self.metrics.export_csv(path)
+        else:
+            self.metrics.export_json(path)
+
+    def post_gesture(self, event):
+        # 手势总线的订阅者，在检测线程中调用
+        self.gesture_received.emit(event)
+
+    def dispatch_gesture(self, event):
+        action = self.gesture_actions.get(event.gesture)
+        if action is None:
+            return
+        action()
+        latency = event.mark_dispatched()
+        self.gesture_latency.append(latency)
+        self.metrics.record('gesture_to_action', latency)
 
 
 def set_colors(music_app):
@@ -320,8 +502,37 @@ def set_colors(music_app):
 if __name__ == '__main__':
     # run_detection()
     app = QApplication(sys.argv)
-    ex = MusicApp()
+    detection_metrics = Metrics()
+    ex = MusicApp(detection_metrics)
     set_colors(app)
-    detection_thread = HandDetection(ex)
-    detection_thread.start()
+    # 设置GESTURE_METRICS_PORT时在本地端口提供Prometheus格式的统计数据
+    if os.environ.get('GESTURE_METRICS_PORT'):
+        detection_metrics.enabled = True
+        detection_metrics.serve(int(os.environ['GESTURE_METRICS_PORT']))
+    # 设置GESTURE_DAEMON为守护进程的socket路径时，识别在独立的gesture_daemon进程中执行，这里只接收手势和预览
+    if os.environ.get('GESTURE_DAEMON'):
+        gesture_client = GestureClient(os.environ['GESTURE_DAEMON'], ex.post_gesture, ex.convert_image)
+        gesture_client.start()
+    else:
+        # 采集、识别和渲染分别在独立的线程中执行
+        hand_detection = HandDetection(ex, metrics=detection_metrics)
+        # 与音频解码共用CPU时自动降低识别的分辨率和帧率
+        hand_detection.adaptive = AdaptiveController()
+        # 识别区域静止时暂停识别，GESTURE_MOTION_GATE=0时关闭
+        if os.environ.get('GESTURE_MOTION_GATE', '1') != '0':
+            hand_detection.motion_gate = MotionGate()
+        # 调参工具生成的配置文件，默认读取当前目录下的detector_profile.json
+        profile_path = os.environ.get('GESTURE_PROFILE', 'detector_profile.json')
+        if os.path.exists(profile_path):
+            hand_detection.load_profile(profile_path)
+        # GESTURE_MODEL为gesture_classifier训练的模型文件时，用模型代替角度规则
+        if os.environ.get('GESTURE_MODEL'):
+            hand_detection.classifier = CentroidClassifier.load(os.environ['GESTURE_MODEL'])
+        if os.environ.get('GESTURE_BACKEND') == 'process':
+            # 识别在多个工作进程中执行，帧通过共享内存传递，界面进程只做采集、投票和显示
+            process_backend = ProcessDetectionBackend(hand_detection)
+            threading.Thread(target=process_backend.run, name='capture', daemon=True).start()
+        else:
+            detection_pipeline = DetectionPipeline(hand_detection)
+            detection_pipeline.start()
     sys.exit(app.exec_())
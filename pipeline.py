@@ -0,0 +1,241 @@
+import collections
+import heapq
+import os
+import threading
+import time
+import traceback
+
+from frame_source import CameraSource, FramePacer, drain_source
+
+# 队列满时的丢帧策略
+DROP_OLDEST = 'drop_oldest'  # 丢掉最早的一帧
+LATEST_ONLY = 'latest_only'  # 只保留最新的一帧
+
+
+class FrameQueue:
+    # 有界帧队列，满时按策略丢帧，并记录深度和丢帧数；on_drop在丢帧时以被丢掉的元素为参数调用
+    def __init__(self, name, maxsize=2, policy=DROP_OLDEST, on_drop=None):
+        if policy not in (DROP_OLDEST, LATEST_ONLY):
+            raise ValueError('unknown drop policy: %s' % policy)
+        self.name = name
+        self.maxsize = 1 if policy == LATEST_ONLY else max(1, maxsize)
+        self.policy = policy
+        self.on_drop = on_drop
+        self.items = collections.deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.put_count = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+    def put(self, item):
+        with self.cond:
+            if self.closed:
+                return False
+            while len(self.items) >= self.maxsize:
+                dropped = self.items.popleft()
+                self.dropped += 1
+                if self.on_drop is not None:
+                    self.on_drop(dropped)
+            self.items.append(item)
+            self.put_count += 1
+            self.max_depth = max(self.max_depth, len(self.items))
+            self.cond.notify()
+            return True
+
+    def get(self, timeout=None):
+        # 队列关闭且为空时返回None
+        with self.cond:
+            while not self.items and not self.closed:
+                if not self.cond.wait(timeout):
+                    return None
+            if self.items:
+                return self.items.popleft()
+            return None
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def depth(self):
+        with self.cond:
+            return len(self.items)
+
+    def stats(self):
+        with self.cond:
+            return {'policy': self.policy, 'maxsize': self.maxsize, 'depth': len(self.items),
+                    'max_depth': self.max_depth, 'put': self.put_count, 'dropped': self.dropped}
+
+
+class DetectionPipeline:
+    # 采集线程 -> 处理线程池 -> 渲染线程，各阶段之间通过有界队列连接
+    # 处理线程取出一帧时分配连续的帧序号，渲染线程把乱序完成的结果按序号重新排列，识别窗口和防抖只在渲染线程中执行
+    # 结果队列丢掉的帧记录在skipped中，渲染线程不再等待这些序号
+    # process_frame中的跟踪状态（track_box、track_frames）按处理完成的顺序更新，多个处理线程时不使用跟踪
+    def __init__(self, detector, source=None, workers=None, capture_policy=LATEST_ONLY, capture_size=1,
+                 result_policy=DROP_OLDEST, result_size=4):
+        if workers is None:
+            workers = max(1, min(4, (os.cpu_count() or 2) - 1))
+        self.detector = detector
+        self.source = source if source is not None else (detector.source or CameraSource(0))
+        self.worker_count = workers
+        self.capture_queue = FrameQueue('capture', capture_size, capture_policy)
+        self.result_queue = FrameQueue('result', result_size, result_policy, self.result_dropped)
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.seq_lock = threading.Lock()
+        self.frames_read = 0
+        self.frames_processed = 0
+        self.frames_rendered = 0
+        self.next_seq = 0  # 处理线程分配的下一个帧序号
+        self.skipped = set()  # 被结果队列丢掉的帧序号
+        self.reordered = 0  # 先于前面的帧完成、等待重新排序的结果数
+        self.window_epoch = 0  # 运动检测每唤醒一次加1，渲染线程看到新的值时清空识别窗口
+        self.active_workers = 0
+        self.threads = []
+
+    def start(self):
+        if self.worker_count > 1:
+            self.detector.track_hand = False
+        self.threads = [threading.Thread(target=self.capture_loop, name='capture', daemon=True)]
+        self.active_workers = self.worker_count
+        for i in range(self.worker_count):
+            self.threads.append(threading.Thread(target=self.process_loop, name='process-%d' % i, daemon=True))
+        self.threads.append(threading.Thread(target=self.render_loop, name='render', daemon=True))
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.capture_queue.close()
+        self.result_queue.close()
+
+    def join(self, timeout=None):
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def capture_loop(self):
+        adaptive = self.detector.adaptive
+        metrics = self.detector.metrics
+        if adaptive is not None:
+            # 多个处理线程并行时，每个线程处理一帧可以使用多个帧的时间
+            adaptive.set_frame_rate(self.source.fps() / self.worker_count)
+        pacer = FramePacer.for_source(self.source)
+        while not self.stop_event.is_set() and self.source.isOpened():
+            pacer.wait()
+            with metrics.stage('capture'):
+                ret, frame = self.source.read()
+            if not ret or frame is None:
+                continue
+            captured_at = time.perf_counter()
+            awake, woke = self.detector.gate_update(frame, captured_at)
+            if woke:
+                # 识别窗口属于渲染线程，这里只改变之后采集的帧所带的编号
+                self.window_epoch += 1
+                drain_source(self.source)
+            if not awake:
+                # 没有人时不识别，识别区域的原图仍经过渲染线程更新预览，帧序号为None
+                if self.detector.music_app is not None:
+                    self.result_queue.put((None, None, self.detector.crop_roi(frame), None, captured_at, None))
+                time.sleep(self.detector.motion_gate.frame_interval())
+                continue
+            if adaptive is not None and adaptive.should_skip():
+                metrics.count('skipped_frames')
+                continue
+            self.capture_queue.put((frame, captured_at, self.window_epoch))
+            self.frames_read += 1
+        self.source.release()
+        self.capture_queue.close()
+
+    def process_loop(self):
+        while not self.stop_event.is_set():
+            with self.seq_lock:
+                # 取帧和分配序号在同一个锁中，序号与采集顺序一致且没有间隔
+                item = self.capture_queue.get()
+                seq = self.next_seq
+                self.next_seq += 1
+            if item is None:
+                break
+            frame, captured_at, epoch = item
+            try:
+                with self.detector.metrics.stage('process'):
+                    res, img_rgb, frame_to_show = self.detector.process_adaptive(frame)
+            except Exception:
+                # 这一帧按没有识别到手处理，仍然送到渲染线程，否则重新排序会一直等待这个序号
+                traceback.print_exc()
+                res, img_rgb, frame_to_show = None, None, None
+            self.result_queue.put((seq, res, img_rgb, frame_to_show, captured_at, epoch))
+            with self.lock:
+                self.frames_processed += 1
+        with self.lock:
+            self.active_workers -= 1
+            if self.active_workers == 0:
+                self.result_queue.close()
+
+    def result_dropped(self, item):
+        # 在结果队列的锁中调用
+        if item[0] is not None:
+            with self.lock:
+                self.skipped.add(item[0])
+
+    def render_loop(self):
+        app = self.detector.music_app
+        pending = []  # 前面还有帧没有完成的结果，按序号排列的堆
+        next_render = 0
+        epoch = 0
+        while not self.stop_event.is_set():
+            item = self.result_queue.get()
+            if item is None:
+                # 处理线程都已退出，剩下的结果不再等待缺少的序号
+                while pending:
+                    epoch = self.render_result(heapq.heappop(pending), app, epoch)
+                break
+            seq = item[0]
+            if seq is None:
+                # 运动检测休眠时的预览帧
+                if app is not None:
+                    app.convert_image(item[2])
+                continue
+            heapq.heappush(pending, item)
+            if seq != next_render:
+                self.reordered += 1
+            while True:
+                with self.lock:
+                    while next_render in self.skipped:
+                        self.skipped.discard(next_render)
+                        next_render += 1
+                if not pending or pending[0][0] != next_render:
+                    break
+                epoch = self.render_result(heapq.heappop(pending), app, epoch)
+                next_render += 1
+
+    def render_result(self, item, app, epoch):
+        # 按帧序号依次进入识别窗口，返回当前的识别窗口编号
+        seq, res, img_rgb, frame_to_show, captured_at, frame_epoch = item
+        metrics = self.detector.metrics
+        if frame_epoch != epoch:
+            self.detector.reset_window()
+        self.detector.handle_result(res, img_rgb, frame_to_show, captured_at)
+        if app is not None and img_rgb is not None:
+            with metrics.stage('convert_image'):
+                app.convert_image(img_rgb)
+        self.frames_rendered += 1
+        metrics.record('total', (time.perf_counter() - captured_at) * 1000.0)
+        metrics.tick()
+        if metrics.enabled:
+            metrics.gauge('dropped_frames', self.dropped_frames())
+            metrics.gauge('capture_queue_depth', self.capture_queue.depth())
+            metrics.gauge('result_queue_depth', self.result_queue.depth())
+        return frame_epoch
+
+    def dropped_frames(self):
+        return self.capture_queue.dropped + self.result_queue.dropped
+
+    def stats(self):
+        with self.lock:
+            processed = self.frames_processed
+        return {'capture': self.capture_queue.stats(), 'result': self.result_queue.stats(),
+                'workers': self.worker_count, 'frames_read': self.frames_read, 'frames_processed': processed,
+                'frames_rendered': self.frames_rendered, 'reordered': self.reordered}
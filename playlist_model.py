@@ -0,0 +1,149 @@
+from array import array
+
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, QSortFilterProxyModel, Qt
+
+COLUMNS = ('标题', '艺术家', '专辑', '时长')
+
+
+def format_duration(seconds):
+    if seconds <= 0:
+        return ''
+    seconds = int(round(seconds))
+    return '%d:%02d' % (seconds // 60, seconds % 60)
+
+
+class TrackStore:
+    # 按列保存曲目，每列一个列表，时长用array保存；不为每首曲目创建对象
+    # keys为标题和艺术家的小写拼接，搜索时直接做子串匹配
+    def __init__(self):
+        self.paths = []
+        self.titles = []
+        self.artists = []
+        self.albums = []
+        self.durations = array('d')
+        self.keys = []
+
+    def __len__(self):
+        return len(self.paths)
+
+    def extend(self, tracks):
+        # tracks为(path, title, artist, album, duration)的列表
+        for path, title, artist, album, duration in tracks:
+            self.paths.append(path)
+            self.titles.append(title)
+            self.artists.append(artist)
+            self.albums.append(album)
+            self.durations.append(duration)
+            self.keys.append(('%s\n%s' % (title, artist)).lower())
+
+    def set(self, row, track):
+        path, title, artist, album, duration = track
+        self.paths[row] = path
+        self.titles[row] = title
+        self.artists[row] = artist
+        self.albums[row] = album
+        self.durations[row] = duration
+        self.keys[row] = ('%s\n%s' % (title, artist)).lower()
+
+    def remove(self, first, last):
+        for column in (self.paths, self.titles, self.artists, self.albums, self.durations, self.keys):
+            del column[first:last + 1]
+
+    def clear(self):
+        self.__init__()
+
+    def rows_of(self, paths):
+        paths = set(paths)
+        return [row for row, path in enumerate(self.paths) if path in paths]
+
+
+def row_ranges(rows):
+    # 把行号合并为连续区间[(first, last)]，按倒序返回，依次删除时前面的行号不变
+    ranges = []
+    for row in sorted(rows):
+        if ranges and ranges[-1][1] == row - 1:
+            ranges[-1][1] = row
+        else:
+            ranges.append([row, row])
+    return [tuple(r) for r in reversed(ranges)]
+
+
+class PlaylistModel(QAbstractTableModel):
+    # 播放列表的表格模型，视图只请求可见行的数据；追加和删除时只发出对应区间的信号，不重建整个列表
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.store = TrackStore()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.store)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row, column = index.row(), index.column()
+        if role == Qt.DisplayRole:
+            if column == 0:
+                return self.store.titles[row]
+            if column == 1:
+                return self.store.artists[row]
+            if column == 2:
+                return self.store.albums[row]
+            return format_duration(self.store.durations[row])
+        if role == Qt.ToolTipRole:
+            return self.store.paths[row]
+        if role == Qt.TextAlignmentRole and column == 3:
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return COLUMNS[section]
+        return super().headerData(section, orientation, role)
+
+    def path(self, row):
+        return self.store.paths[row]
+
+    def append_tracks(self, tracks):
+        if not tracks:
+            return
+        first = len(self.store)
+        self.beginInsertRows(QModelIndex(), first, first + len(tracks) - 1)
+        self.store.extend(tracks)
+        self.endInsertRows()
+
+    def update_tracks(self, tracks):
+        rows = {path: row for row, path in enumerate(self.store.paths)}
+        for track in tracks:
+            row = rows.get(track[0])
+            if row is not None:
+                self.store.set(row, track)
+                self.dataChanged.emit(self.index(row, 0), self.index(row, len(COLUMNS) - 1))
+
+    def remove_ranges(self, ranges):
+        # ranges为row_ranges的结果
+        for first, last in ranges:
+            self.beginRemoveRows(QModelIndex(), first, last)
+            self.store.remove(first, last)
+            self.endRemoveRows()
+
+    def clear(self):
+        self.beginResetModel()
+        self.store.clear()
+        self.endResetModel()
+
+
+class PlaylistFilter(QSortFilterProxyModel):
+    # 按标题和艺术家搜索，查询为空时显示全部；新增的行只对新行做判断
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.query = ''
+
+    def set_query(self, text):
+        self.query = text.strip().lower()
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        return not self.query or self.query in self.sourceModel().store.keys[source_row]
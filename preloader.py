@@ -0,0 +1,98 @@
+import collections
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TrackPreloader:
+    # 把当前曲目前后的几首读入内存，切歌时直接从内存播放，不再等待打开网络路径上的文件
+    # 缓存按最近使用淘汰，总大小不超过max_bytes，超过max_file_bytes的文件不预读
+    def __init__(self, ahead=2, behind=1, max_bytes=256 * 1024 * 1024, max_file_bytes=64 * 1024 * 1024,
+                 workers=2):
+        self.ahead = ahead
+        self.behind = behind
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='preload')
+        self.lock = threading.Lock()
+        self.cache = collections.OrderedDict()  # path -> bytes，最近使用的在末尾
+        self.loading = set()
+        self.cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def neighbours(self, index, count):
+        # 当前曲目之后ahead首和之前behind首的位置，列表首尾相接
+        if count == 0 or index < 0:
+            return []
+        offsets = list(range(1, self.ahead + 1)) + [-i for i in range(1, self.behind + 1)]
+        seen = {index}
+        result = []
+        for offset in offsets:
+            i = (index + offset) % count
+            if i not in seen:
+                seen.add(i)
+                result.append(i)
+        return result
+
+    def schedule(self, paths):
+        # 在后台读入paths中还没有缓存的文件，已缓存的移到末尾，避免马上被淘汰
+        for path in paths:
+            with self.lock:
+                if path in self.cache:
+                    self.cache.move_to_end(path)
+                    continue
+                if path in self.loading:
+                    continue
+                self.loading.add(path)
+            try:
+                self.executor.submit(self.load, path)
+            except RuntimeError:
+                # 已经关闭
+                with self.lock:
+                    self.loading.discard(path)
+                return
+
+    def load(self, path):
+        data = None
+        try:
+            if os.path.getsize(path) <= self.max_file_bytes:
+                with open(path, 'rb') as f:
+                    data = f.read()
+        except OSError:
+            pass
+        with self.lock:
+            self.loading.discard(path)
+            if data is None or len(data) > self.max_bytes:
+                return
+            self.cache[path] = data
+            self.cached_bytes += len(data)
+            while self.cached_bytes > self.max_bytes:
+                _, evicted = self.cache.popitem(last=False)
+                self.cached_bytes -= len(evicted)
+                self.evictions += 1
+
+    def get(self, path):
+        # 返回缓存的文件内容，没有缓存时返回None
+        with self.lock:
+            data = self.cache.get(path)
+            if data is None:
+                self.misses += 1
+                return None
+            self.cache.move_to_end(path)
+            self.hits += 1
+            return data
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.cached_bytes = 0
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+    def stats(self):
+        with self.lock:
+            return {'tracks': len(self.cache), 'bytes': self.cached_bytes, 'loading': len(self.loading),
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
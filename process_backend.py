@@ -0,0 +1,207 @@
+import heapq
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from frame_source import CameraSource, FramePacer
+from hand_rec import HandDetection
+
+
+class SharedFrameRing:
+    # 共享内存中的环形帧缓冲，slots个槽位，每个槽位最多slot_bytes字节
+    # 主进程把帧拷贝进槽位，工作进程直接在共享内存上构造numpy数组，帧本身不经过pickle
+    def __init__(self, slots, slot_bytes, name=None):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.name = self.shm.name
+
+    def view(self, slot, shape, dtype=np.uint8):
+        return np.ndarray(shape, dtype, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+
+    def write(self, slot, frame):
+        if frame.nbytes > self.slot_bytes:
+            raise ValueError('frame of %d bytes does not fit in a %d byte slot' % (frame.nbytes, self.slot_bytes))
+        np.copyto(self.view(slot, frame.shape, frame.dtype), frame)
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def worker_main(ring_name, slots, slot_bytes, params, classifier, tasks, results):
+    # 工作进程：从共享内存读帧，只把识别结果的小字典发回主进程
+    ring = SharedFrameRing(slots, slot_bytes, ring_name)
+    detector = HandDetection(None)
+    detector.set_params(params)
+    detector.classifier = classifier
+    # 导入和初始化完成后通知主进程，此后才会收到帧
+    results.put('ready')
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            seq, slot, shape, scale = task
+            start = time.perf_counter()
+            try:
+                res, _, _ = detector.process_frame(ring.view(slot, shape), scale)
+            except Exception:
+                # 这一帧按没有识别到手处理，仍然返回序号，否则主进程的重排序会一直等待这一帧
+                traceback.print_exc()
+                res = None
+            results.put((seq, slot, res, time.perf_counter() - start))
+    finally:
+        ring.close()
+
+
+class ProcessDetectionBackend:
+    # 在多个进程中执行肤色检测、轮廓检测和手势匹配，结果按帧序号重新排序后在主进程中进入识别窗口
+    # 工作进程之间不共享跟踪状态，每一帧都在整个识别区域中处理
+    def __init__(self, detector, workers=None, slots=None):
+        self.detector = detector
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.slots = slots or self.workers * 2
+        self.context = multiprocessing.get_context('spawn')
+        self.ring = None
+        self.processes = []
+        self.tasks = None
+        self.results = None
+        self.free_slots = queue.Queue()
+        self.lock = threading.Lock()
+        self.pending = []  # 已经返回但前面还有帧没有返回的结果，按序号排列的堆
+        self.captured = {}
+        self.next_submit = 0
+        self.next_result = 0
+        self.dropped = 0
+        self.collector = None
+
+    def start(self, frame_shape, timeout=60.0):
+        slot_bytes = int(np.prod(frame_shape))
+        self.ring = SharedFrameRing(self.slots, slot_bytes)
+        self.tasks = self.context.Queue()
+        self.results = self.context.Queue()
+        self.free_slots = queue.Queue()
+        for slot in range(self.slots):
+            self.free_slots.put(slot)
+        params = self.detector.get_params()
+        # 分类器只包含numpy数组，随参数一起传给工作进程
+        classifier = self.detector.classifier
+        for i in range(self.workers):
+            process = self.context.Process(target=worker_main, name='detection-%d' % i, daemon=True,
+                                           args=(self.ring.name, self.slots, slot_bytes, params, classifier,
+                                                 self.tasks, self.results))
+            process.start()
+            self.processes.append(process)
+        # spawn的进程需要一两秒导入OpenCV，全部就绪之前提交的帧会占满槽位，之后采集到的帧都被丢弃
+        for _ in self.processes:
+            try:
+                self.results.get(timeout=timeout)
+            except queue.Empty:
+                self.stop()
+                raise RuntimeError('detection workers did not start within %.0fs' % timeout)
+        self.collector = threading.Thread(target=self.collect_loop, name='collector', daemon=True)
+        self.collector.start()
+
+    def submit(self, frame, captured_at=None, scale=1.0):
+        # 没有空闲槽位时丢弃这一帧，返回分配的帧序号或None
+        if self.ring is None or frame.nbytes > self.ring.slot_bytes:
+            # 槽位大小由第一帧决定，分辨率变大时等已提交的帧处理完，再按新的大小重新创建共享内存和工作进程
+            self.stop()
+            self.start(frame.shape)
+        try:
+            slot = self.free_slots.get_nowait()
+        except queue.Empty:
+            self.dropped += 1
+            return None
+        self.ring.write(slot, frame)
+        with self.lock:
+            seq = self.next_submit
+            self.next_submit += 1
+            self.captured[seq] = time.perf_counter() if captured_at is None else captured_at
+        self.tasks.put((seq, slot, frame.shape, scale))
+        return seq
+
+    def collect_loop(self):
+        while True:
+            item = self.results.get()
+            if item is None:
+                break
+            seq, slot, res, elapsed = item
+            self.free_slots.put(slot)
+            if self.detector.adaptive is not None:
+                # 多个进程并行处理，每帧平均占用的时间按进程数折算
+                self.detector.adaptive.update(elapsed / self.workers)
+            with self.lock:
+                heapq.heappush(self.pending, (seq, res))
+                ready = []
+                while self.pending and self.pending[0][0] == self.next_result:
+                    seq, res = heapq.heappop(self.pending)
+                    ready.append((res, self.captured.pop(seq)))
+                    self.next_result += 1
+            # 按帧序号依次进入识别窗口和防抖逻辑
+            for res, captured_at in ready:
+                self.detector.handle_result(res, None, None, captured_at)
+
+    def run(self, source=None):
+        # 与HandDetection.run相同的采集循环，预览只显示识别区域的原图
+        camera = source if source is not None else (self.detector.source or CameraSource(0))
+        detector = self.detector
+        app = detector.music_app
+        if detector.adaptive is not None:
+            # collect_loop已经把每帧的耗时按进程数折算，这里使用摄像头的帧率
+            detector.adaptive.set_frame_rate(camera.fps())
+        pacer = FramePacer.for_source(camera)
+        try:
+            while camera.isOpened():
+                pacer.wait()
+                ret, frame = camera.read()
+                if not ret or frame is None:
+                    continue
+                captured_at = time.perf_counter()
+                if not detector.gate_frame(frame, captured_at):
+                    if app is not None:
+                        app.convert_image(detector.crop_roi(frame))
+                    time.sleep(detector.motion_gate.frame_interval())
+                    continue
+                if detector.adaptive is not None and detector.adaptive.should_skip():
+                    continue
+                scale = detector.adaptive.scale() if detector.adaptive is not None else 1.0
+                self.submit(frame, captured_at, scale)
+                if app is not None:
+                    app.convert_image(detector.crop_roi(frame))
+        finally:
+            camera.release()
+            self.stop()
+
+    def stop(self):
+        if self.ring is None:
+            return
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join()
+        self.results.put(None)
+        if self.collector is not None:
+            self.collector.join()
+        self.collector = None
+        self.ring.close()
+        self.ring = None
+        self.processes = []
+
+    def stats(self):
+        with self.lock:
+            return {'workers': self.workers, 'slots': self.slots, 'submitted': self.next_submit,
+                    'completed': self.next_result, 'reorder_pending': len(self.pending), 'dropped': self.dropped}
@@ -0,0 +1,74 @@
+import threading
+
+import cv2
+import numpy as np
+
+
+class SkinLUT:
+    # 以(Cr, Cb)为下标的二维查找表，值为255的格子认为是肤色
+    # 查找表由OTSU的分割结果统计得到：每隔refresh_interval帧用OTSU重新分割一次，把新的统计结果按decay衰减后累加
+    # 多个处理线程可以共用一个查找表，计数和统计在锁中更新
+    def __init__(self, refresh_interval=300, decay=0.5, smoothing=5, min_pixels=500):
+        self.refresh_interval = refresh_interval
+        self.decay = decay
+        self.smoothing = smoothing  # 对统计直方图做高斯平滑，填补没有出现过的颜色
+        self.min_pixels = min_pixels  # 肤色像素太少时不更新，避免没有手的画面把查找表带偏
+        self.skin_hist = np.zeros((256, 256), np.float32)
+        self.total_hist = np.zeros((256, 256), np.float32)
+        self.table = None
+        self.lock = threading.Lock()
+        self.refreshing = False  # 已经有一个线程在用OTSU重新统计
+        self.frames_since_refresh = 0
+        self.calibrations = 0
+
+    def ready(self):
+        return self.table is not None
+
+    def needs_refresh(self):
+        # 只查询，不改变计数
+        return self.table is None or self.frames_since_refresh >= self.refresh_interval
+
+    def begin_frame(self):
+        # 计为一帧并返回这一帧是否查表；需要刷新时只有一个线程得到False去用OTSU重新统计，其余线程继续查旧表
+        with self.lock:
+            if self.table is None:
+                return False
+            if self.frames_since_refresh >= self.refresh_interval and not self.refreshing:
+                self.refreshing = True
+                return False
+            self.frames_since_refresh += 1
+            return True
+
+    def calibrate(self, cr, cb, mask):
+        # cr、cb为同尺寸的单通道图像，mask为OTSU得到的肤色二值图
+        skin = mask > 0
+        with self.lock:
+            self.frames_since_refresh = 0
+            self.refreshing = False
+            if np.count_nonzero(skin) < self.min_pixels:
+                return False
+            return self.update_table(cr, cb, skin)
+
+    def update_table(self, cr, cb, skin):
+        index = (cr.astype(np.intp) << 8) | cb
+        total_hist = np.bincount(index.ravel(), minlength=65536).reshape(256, 256).astype(np.float32)
+        skin_hist = np.bincount(index[skin], minlength=65536).reshape(256, 256).astype(np.float32)
+        if self.table is None:
+            self.skin_hist, self.total_hist = skin_hist, total_hist
+        else:
+            self.skin_hist = self.skin_hist * self.decay + skin_hist
+            self.total_hist = self.total_hist * self.decay + total_hist
+        k = self.smoothing
+        skin_smooth = cv2.GaussianBlur(self.skin_hist, (k, k), 0)
+        total_smooth = cv2.GaussianBlur(self.total_hist, (k, k), 0)
+        # 某个颜色中肤色像素超过一半就认为是肤色；整体替换，处理线程读到的总是完整的查找表
+        table = np.zeros((256, 256), np.uint8)
+        table[(skin_smooth * 2 > total_smooth) & (total_smooth > 1e-3)] = 255
+        self.table = table
+        self.calibrations += 1
+        return True
+
+    def classify(self, ycrcb):
+        # 每个像素只查一次表
+        table = self.table
+        return table.ravel()[(ycrcb[:, :, 1].astype(np.intp) << 8) | ycrcb[:, :, 2]]
@@ -0,0 +1,249 @@
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from gesture_eval import clip_from_spec, score_clip, tolerance_frames
+from hand_rec import HandDetection
+
+# 默认的搜索范围，按对中间结果的影响分为三组：
+# 分割参数决定每帧的轮廓，角度参数决定每帧的识别结果，窗口和防抖参数只影响对识别结果序列的回放
+SEGMENT_GRID = {'blurValue': (21, 31, 41, 51)}
+ANGLE_GRID = {'angle_offset_left': (0.15, 0.25, 0.35), 'angle_offset_right': (0.3, 0.5, 0.7)}
+WINDOW_GRID = {'window_ms': (200, 267, 333, 467), 'valuable_window': (0.6, 0.8), 'valuable_frame': (0.7, 0.9),
+               'repeat_ms': (0, 33, 67), 'cooldown_ms': (333, 667, 1000)}
+
+
+def grid_points(grid):
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+class ContourRecorder(HandDetection):
+    # 执行与process_frame相同的分割和轮廓检测，只记录面积最大的轮廓，不做手势匹配
+    def __init__(self):
+        HandDetection.__init__(self, None)
+        self.contour = None
+
+    def gesture_detection(self, max_contour, drawing, frame):
+        self.contour = max_contour
+        return False, 0, None
+
+
+def cache_path(cache_dir, spec, params):
+    # 缓存文件名由序列和影响分割结果的参数决定，序列文件被修改后缓存失效
+    key = [os.path.abspath(spec) if os.path.exists(spec) else spec, sorted(params.items())]
+    if os.path.exists(spec):
+        key.append(os.path.getmtime(spec))
+    digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, 'contours-%s.npz' % digest)
+
+
+def load_contours(path):
+    data = np.load(path)
+    lengths, points = data['lengths'], data['points']
+    starts = np.cumsum(lengths) - lengths
+    return [points[s:s + n].reshape(-1, 1, 2) if n else None for s, n in zip(starts, lengths)]
+
+
+def save_contours(path, contours):
+    # 所有帧的轮廓拼接保存，没有轮廓的帧长度为0
+    lengths = np.array([0 if c is None else len(c) for c in contours], np.int64)
+    points = [c.reshape(-1, 2) for c in contours if c is not None]
+    points = np.concatenate(points).astype(np.int32) if points else np.zeros((0, 2), np.int32)
+    tmp_path = path + '.tmp.npz'
+    np.savez_compressed(tmp_path, lengths=lengths, points=points)
+    os.replace(tmp_path, path)
+
+
+def segment_task(args):
+    # 工作进程：得到一个序列在一组分割参数下每帧的轮廓（读缓存或重新计算），再对每组角度参数计算每帧的识别结果
+    spec, hold_ms, frame_rate, base_params, segment_params, angle_points, cache_dir = args
+    params = dict(base_params, **segment_params)
+    path = cache_path(cache_dir, spec, dict(params, hold_ms=hold_ms, frame_rate=frame_rate)) if cache_dir else None
+    if path and os.path.exists(path):
+        contours = load_contours(path)
+    else:
+        recorder = ContourRecorder()
+        recorder.set_params(params)
+        contours = []
+        for frame in clip_from_spec(spec, hold_ms, frame_rate).read_frames():
+            recorder.contour = None
+            recorder.process_frame(frame)
+            contours.append(recorder.contour)
+        if path:
+            save_contours(path, contours)
+    detector = HandDetection(None)
+    detector.set_params(params)
+    scratch = np.zeros((1, 1, 3), np.uint8)
+    results = []
+    for angle_params in angle_points:
+        detector.set_params(angle_params)
+        results.append([None if c is None else detector.gesture_result(c, scratch, None) for c in contours])
+    return results
+
+
+def replay_results(results, frame_rate, params):
+    # 把每帧的识别结果按顺序送入识别窗口和防抖逻辑，返回(帧号, 手势事件)的列表
+    detector = HandDetection(None)
+    detector.set_params(params)
+    events = []
+    frame_index = [0]
+    detector.bus.subscribe(lambda event: events.append((frame_index[0], event)))
+    for i, res in enumerate(results):
+        frame_index[0] = i
+        detector.handle_result(res, None, None, i / frame_rate)
+    return events
+
+
+def score_events(clip, events, tolerance):
+    # 决策延迟：手势开始到第一次正确触发的帧数，漏检的手势按整段长度加容忍帧数计；误触发：与标注不符的事件
+    decision, missed, false_triggers, attributed = [], 0, 0, 0
+    for start, end, label, hits in score_clip(clip, events, tolerance):
+        attributed += len(hits)
+        false_triggers += sum(1 for _, gesture in hits if gesture != label)
+        if label is None:
+            continue
+        correct = [frame for frame, gesture in hits if gesture == label]
+        if correct:
+            decision.append(correct[0] - start)
+        else:
+            missed += 1
+            decision.append(end - start + tolerance)
+    false_triggers += len(events) - attributed
+    return decision, missed, false_triggers
+
+
+_replay_inputs = None
+
+
+def init_replay(inputs):
+    global _replay_inputs
+    _replay_inputs = inputs
+
+
+def replay_task(args):
+    # 工作进程：在每个序列上回放一组参数，识别结果在进程启动时传入
+    key, params = args
+    decision, missed, false_triggers = [], 0, 0
+    for clip, results in zip(_replay_inputs['clips'], _replay_inputs['results'][key]):
+        events = replay_results(results, clip.frame_rate, params)
+        d, m, f = score_events(clip, events, tolerance_frames(params, clip.frame_rate))
+        decision.extend(d)
+        missed += m
+        false_triggers += f
+    return {'params': params, 'decision_frames': float(np.mean(decision)) if decision else 0.0,
+            'missed': missed, 'false_triggers': false_triggers}
+
+
+def pareto_front(candidates):
+    # 决策延迟和误触发都越小越好，保留不被其他参数组合同时超过的点
+    front = []
+    for item in sorted(candidates, key=lambda c: (c['decision_frames'], c['false_triggers'], c['missed'])):
+        if not front or item['false_triggers'] < front[-1]['false_triggers']:
+            front.append(item)
+    return front
+
+
+def tune(specs, base_params=None, segment_grid=SEGMENT_GRID, angle_grid=ANGLE_GRID, window_grid=WINDOW_GRID,
+         workers=None, cache_dir='.tuner_cache', hold_ms=1500, frame_rate=30.0):
+    if base_params is None:
+        base_params = HandDetection(None).get_params()
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    # 用于打分的标注，帧在工作进程中读取
+    clips = [clip_from_spec(spec, hold_ms, frame_rate) for spec in specs]
+    for clip in clips:
+        if not isinstance(clip.frames, list):
+            clip.frames.release()
+        clip.frames = None
+    segment_points, angle_points, window_points = grid_points(segment_grid), grid_points(angle_grid), \
+        grid_points(window_grid)
+    context = multiprocessing.get_context('spawn')
+    workers = workers or os.cpu_count() or 1
+
+    start = time.perf_counter()
+    tasks = [(spec, hold_ms, frame_rate, base_params, segment_params, angle_points, cache_dir)
+             for segment_params in segment_points for spec in specs]
+    with context.Pool(workers) as pool:
+        outputs = pool.map(segment_task, tasks)
+    segment_seconds = time.perf_counter() - start
+    # results[(分割参数序号, 角度参数序号)] 为每个序列的识别结果列表
+    results = {}
+    for n, output in enumerate(outputs):
+        for a, frame_results in enumerate(output):
+            results.setdefault((n // len(specs), a), []).append(frame_results)
+
+    start = time.perf_counter()
+    tasks = []
+    for (s, a) in results:
+        for window_params in window_points:
+            params = dict(base_params, **segment_points[s])
+            params.update(angle_points[a])
+            params.update(window_params)
+            tasks.append(((s, a), params))
+    with context.Pool(workers, initializer=init_replay, initargs=({'clips': clips, 'results': results},)) as pool:
+        candidates = pool.map(replay_task, tasks, chunksize=max(1, len(tasks) // (workers * 8)))
+    replay_seconds = time.perf_counter() - start
+    front = pareto_front(candidates)
+    return {'candidates': len(candidates), 'segment_seconds': segment_seconds, 'replay_seconds': replay_seconds,
+            'front': front}
+
+
+def choose_profile(front, max_false_triggers=0):
+    # 误触发不超过max_false_triggers的点中决策最快的一个，没有这样的点时取误触发最少的点
+    allowed = [item for item in front if item['false_triggers'] <= max_false_triggers]
+    if allowed:
+        return allowed[0]
+    return front[-1]
+
+
+def parse_grid(values):
+    # 命令行中的 name=v1,v2,... 覆盖默认的搜索范围
+    grids = (dict(SEGMENT_GRID), dict(ANGLE_GRID), dict(WINDOW_GRID))
+    for value in values:
+        name, _, items = value.partition('=')
+        items = tuple(json.loads(item) for item in items.split(','))
+        for grid in grids:
+            if name in grid:
+                grid[name] = items
+                break
+        else:
+            raise KeyError('parameter %s cannot be tuned' % name)
+    return grids
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='识别参数调优：并行搜索参数组合，输出决策延迟与误触发的Pareto前沿')
+    parser.add_argument('clips', nargs='*', default=['synthetic'],
+                        help='带labels.csv的图片文件夹、带同名csv的视频或 synthetic[:N]')
+    parser.add_argument('--grid', action='append', default=[], help='搜索范围，例如 blurValue=31,41')
+    parser.add_argument('--fps', type=float, default=30.0, help='合成序列的帧率')
+    parser.add_argument('--workers', type=int, default=None, help='进程数，默认为CPU核数')
+    parser.add_argument('--cache', default='.tuner_cache', help='轮廓缓存目录，为空时不缓存')
+    parser.add_argument('--max-false', type=int, default=0, help='选择配置时允许的误触发次数')
+    parser.add_argument('--output', default='detector_profile.json', help='写入选中的配置')
+    parser.add_argument('--front', default=None, help='把Pareto前沿写入json文件')
+    args = parser.parse_args()
+
+    report = tune(args.clips, None, *parse_grid(args.grid), workers=args.workers, cache_dir=args.cache,
+                  frame_rate=args.fps)
+    print('%d candidates, segmentation %.1fs, replay %.1fs'
+          % (report['candidates'], report['segment_seconds'], report['replay_seconds']))
+    print('%10s %8s %7s  params' % ('decision', 'false', 'missed'))
+    for point in report['front']:
+        tuned = {name: point['params'][name] for name in sorted(point['params'])
+                 if any(name in grid for grid in (SEGMENT_GRID, ANGLE_GRID, WINDOW_GRID))}
+        print('%10.1f %8d %7d  %s' % (point['decision_frames'], point['false_triggers'], point['missed'], tuned))
+    if args.front:
+        with open(args.front, 'w') as f:
+            json.dump(report['front'], f, indent=2)
+    chosen = choose_profile(report['front'], args.max_false)
+    with open(args.output, 'w') as f:
+        json.dump(chosen, f, indent=2)
+    print('profile written to %s' % args.output)
@@ -0,0 +1,129 @@
+import collections
+import time
+
+# 票数相同时按以下顺序取第一个，与原来对字典按票数做稳定排序的结果一致
+FINGER_ORDER = (0, 1, 2, 3, 4, 5, 6)
+DIRECTION_ORDER = ("NULL", "LEFT", "RIGHT", "UP", "DOWN", "NOT_FOUND")
+
+
+class ClassCounter:
+    # 维护每个类别的票数和“票数 -> 类别集合”的桶，增减票和取最多票的类别都是O(1)
+    def __init__(self, order=()):
+        self.rank = {cls: i for i, cls in enumerate(order)}
+        self.counts = {}
+        self.buckets = collections.defaultdict(set)
+        self.max_count = 0
+
+    def add(self, cls):
+        count = self.counts.get(cls, 0)
+        if count:
+            self.buckets[count].discard(cls)
+        self.counts[cls] = count + 1
+        self.buckets[count + 1].add(cls)
+        if count + 1 > self.max_count:
+            self.max_count = count + 1
+
+    def remove(self, cls):
+        count = self.counts[cls]
+        self.buckets[count].discard(cls)
+        if count == 1:
+            del self.counts[cls]
+        else:
+            self.counts[cls] = count - 1
+            self.buckets[count - 1].add(cls)
+        if count == self.max_count and not self.buckets[count]:
+            self.max_count -= 1
+
+    def most_common(self):
+        if self.max_count == 0:
+            return None, 0
+        classes = self.buckets[self.max_count]
+        if len(classes) == 1:
+            return next(iter(classes)), self.max_count
+        return min(classes, key=lambda cls: self.rank.get(cls, len(self.rank))), self.max_count
+
+    def clear(self):
+        self.counts.clear()
+        self.buckets.clear()
+        self.max_count = 0
+
+
+class VoteWindow:
+    # 滑动识别窗口：最多保存size帧，设置duration（秒）时还会淘汰超过该时长的帧
+    # 每次加入和淘汰时更新票数，投票不需要遍历窗口
+    def __init__(self, size=10, duration=None, min_entries=3):
+        self.size = size
+        self.duration = duration
+        self.min_entries = min_entries
+        self.entries = collections.deque()
+        self.fingers = ClassCounter(FINGER_ORDER)
+        self.directions = ClassCounter(DIRECTION_ORDER)
+        self.detected = 0
+        self.started_at = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def push(self, res, now=None):
+        if now is None:
+            now = time.perf_counter()
+        if self.started_at is None:
+            self.started_at = now
+        self.entries.append((now, res))
+        if res["detected"]:
+            self.detected += 1
+            self.fingers.add(res["fingers"])
+            self.directions.add(res["direction"])
+        while len(self.entries) > self.size:
+            self.evict()
+        if self.duration is not None:
+            while self.entries and now - self.entries[0][0] > self.duration:
+                self.evict()
+
+    def evict(self):
+        _, res = self.entries.popleft()
+        if res["detected"]:
+            self.detected -= 1
+            self.fingers.remove(res["fingers"])
+            self.directions.remove(res["direction"])
+
+    def clear(self):
+        self.entries.clear()
+        self.fingers.clear()
+        self.directions.clear()
+        self.detected = 0
+        self.started_at = None
+
+    def ready(self, now=None):
+        if self.duration is None:
+            return len(self.entries) >= self.size
+        if now is None:
+            now = time.perf_counter()
+        return len(self.entries) >= self.min_entries and now - self.started_at >= self.duration
+
+    def capacity(self):
+        # 计算比例时的分母：按帧数计时为窗口大小，按时间计时为窗口中实际的帧数
+        return self.size if self.duration is None else len(self.entries)
+
+    def majority_fingers(self):
+        cls, count = self.fingers.most_common()
+        return cls, count / self.capacity() if self.entries else 0.0
+
+    def majority_direction(self):
+        cls, count = self.directions.most_common()
+        return cls, count / self.capacity() if self.entries else 0.0
+
+    def vote(self, valuable_window, valuable_frame, now=None):
+        # 有效帧占比不少于valuable_window，且同一类别的票数超过有效帧的valuable_frame才输出该类别
+        if not self.ready(now):
+            return None
+        capacity = self.capacity()
+        if self.detected < valuable_window * capacity:
+            return None
+        need = capacity * valuable_window * valuable_frame
+        fingers, f_count = self.fingers.most_common()
+        direction, d_count = self.directions.most_common()
+        return {'fingers': fingers if f_count > need else None,
+                'direction': direction if d_count > need else None,
+                'fingers_confidence': f_count / capacity,
+                'direction_confidence': d_count / capacity}